@@ -1,4 +1,5 @@
 import argparse
+from datetime import timedelta
 
 from encoding.code93 import Code93
 from encoding.code128 import Code128
@@ -8,12 +9,43 @@ from font import font5x7
 
 from qrcode.qrcode import QRCode
 
+from image.bitmap import Bitmap
 from image.svg import SvgBarcodeImage
 from image.png import PngBarcodeImage
 from image.bmp import BmpBarcodeImage
 from image.gif import GifBarcodeImage
 
 
+def mask_strategy(value):
+    if value in ("auto", "fast"):
+        return value
+    if value.isdigit() and 0 <= int(value) <= 7:
+        return int(value)
+    if value.endswith("us") and value[:-2].isdigit():
+        return timedelta(microseconds=int(value[:-2]))
+    raise argparse.ArgumentTypeError(
+        "Expected auto, fast, mask index 0-7 or time budget such as 500us"
+    )
+
+
+def positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(
+            "Expected number greater than 0, got {!r}".format(value)
+        )
+    return number
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "Expected integer greater than 0, got {!r}".format(value)
+        )
+    return number
+
+
 parser = argparse.ArgumentParser(
     description="Generate an image of barcode",
 )
@@ -21,7 +53,7 @@ parser.add_argument(
     '--file-type',
     type=str,
     default=None,
-    choices=["svg", "png", "bmp", "gif"],
+    choices=["svg", "svgz", "png", "bmp", "gif"],
     help="Generated image filetype."
 )
 parser.add_argument(
@@ -38,6 +70,15 @@ parser.add_argument(
     help="Bar width for 1D barcodes and elementary module "\
          "size for 2D barcode (in pixels)."
 )
+parser.add_argument(
+    "--module-size",
+    type=positive_float,
+    default=None,
+    help="Printed width of a module in millimetres, stored as pixel "\
+         "density in PNG and BMP images. Scale defaults to 1 pixel "\
+         "per module when given. Rejected for other file types, "\
+         "which can't store pixel density."
+)
 parser.add_argument(
     # TODO: Consider encoding type to choose the right default
     "--barcode-height",
@@ -59,6 +100,36 @@ parser.add_argument(
     default=None,
     help="Label height."
 )
+parser.add_argument(
+    "--mask",
+    type=mask_strategy,
+    default="auto",
+    help="QR code mask: auto evaluates all masks, fast approximates "\
+         "the evaluation, 0-7 selects mask directly and time budget "\
+         "in microseconds such as 500us stops evaluation early."
+)
+parser.add_argument(
+    "--code128-encoding",
+    type=str,
+    default="auto",
+    choices=["auto", "A", "B", "C"],
+    help="Code128 code set, auto switches between A, B and C to make "\
+         "the barcode as short as possible."
+)
+parser.add_argument(
+    "--png-preset",
+    type=str,
+    default="default",
+    choices=["default", "speed", "size"],
+    help="PNG compression preset, speed compresses faster, size "\
+         "produces smaller files."
+)
+parser.add_argument(
+    "--png-workers",
+    type=positive_int,
+    default=1,
+    help="Number of threads compressing PNG image data."
+)
 parser.add_argument(
     "content",
     type=str,
@@ -81,6 +152,7 @@ def main(cmd_args=None):
     }
     image_classes = {
         "svg": SvgBarcodeImage,
+        "svgz": SvgBarcodeImage,
         "png": PngBarcodeImage,
         "bmp": BmpBarcodeImage,
         "gif": GifBarcodeImage
@@ -95,7 +167,11 @@ def main(cmd_args=None):
         raise ValueError(
             "Unknown barcode encoding {!r}".format(args.barcode_type)
         )
-    scale = args.scale or (2 if encoding.dimensionality == "linear" else 16)
+    if args.module_size is not None:
+        scale = args.scale or 1
+    else:
+        scale = args.scale or \
+            (2 if encoding.dimensionality == "linear" else 16)
     barcode_height = args.barcode_height  # TODO: take default height from barcode type
     file_type = args.file_type
     if file_type is None:
@@ -107,19 +183,44 @@ def main(cmd_args=None):
         raise ValueError(
             "Unknown image file type {!r}".format(args.file_type)
         )
+    if args.module_size is not None and \
+            image_class not in (PngBarcodeImage, BmpBarcodeImage):
+        raise ValueError(
+            "Module size can't be stored in {!r} images".format(file_type)
+        )
 
     data = None
+    image_options = {}
+    encoding_options = {}
+    if encoding is Code128:
+        encoding_options["encoding"] = args.code128_encoding
     if encoding.dimensionality == "linear":
-        data = encoding.bars(args.content)
+        if image_class is SvgBarcodeImage:
+            image_options["bar_widths"] = encoding.widths(
+                args.content,
+                **encoding_options
+            )
+        else:
+            row, width = encoding.to_int(args.content, **encoding_options)
+            data = Bitmap.from_ints([row], width)
     elif encoding.dimensionality == "2D":
-        data = encoding.image_bits(args.content)
+        data = Bitmap.from_ints(
+            *encoding.image_rows(args.content, mask=args.mask)
+        )
     else:
         raise NotImplementedError
+    if image_class is PngBarcodeImage:
+        image_options["preset"] = args.png_preset
+        image_options["workers"] = args.png_workers
+    elif file_type == "svgz":
+        image_options["compress"] = True
     image = image_class(
         data_bits=data,
         barcode_height=args.barcode_height,
         scale=scale,
         barcode_type=encoding.dimensionality,
+        module_size=args.module_size,
+        **image_options
     )
     if args.label is not None:
         # TODO: support for 2D barcode label
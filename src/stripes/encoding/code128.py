@@ -1,6 +1,18 @@
+import re
+from itertools import repeat
+
 from .encoding import BarcodeEncoding
 
 
+# characters outside of code sets
+_invalid = {
+    "A": re.compile("[^\x00-\x5f]"),
+    "B": re.compile("[^\x20-\x7f]"),
+    "C": re.compile("[^0-9]"),
+    "auto": re.compile("[^\x00-\x7f]")
+}
+
+
 class Code128(BarcodeEncoding):
     """
     Encoder for Code128 (A, B and C variant) barcode.
@@ -33,116 +45,217 @@ class Code128(BarcodeEncoding):
     switch_B_to_A = 101
     switch_B_to_C = 99
     switch_C_to_A = 101
-    switch_C_to_B = 102
+    switch_C_to_B = 100
 
     # stop pattern, 13 bits long
     stop = 6379
+    stop_bitlength = 13
+
+    quiet_zone_width = 10
 
     # bit length of non-control characters
     code_bitlength = 11
 
-    @classmethod
-    def _enc_A(cls, char):
-        """Encode single character from A alphabet
-        
-        :param str char:    A character
-        :return:           Character code integer"""
-        code = ord(char)
-        if code < 32:
-            return code + 64
-        elif 32 <= code < 96:
-            return code - 32
-        else:
-            raise ValueError(
-                "{!r} can't be encoded in code128A alphabet".format(char)
-            )
-
-    @classmethod
-    def _enc_B(cls, char):
-        """Encode single character from B alphabet
-
-        :param str char:    A character
-        :return:           Character code integer"""
-        code = ord(char)
-        if 32 <= code < 128:
-            return code - 32
-        else:
-            raise ValueError(
-                "{!r} can't be encoded in code128B alphabet".format(char)
-            )
-
-    @classmethod
-    def _enc_C(cls, two_chars):
-        """Encode pair of integer digit characters into C alphabet code
-
-        :param str char:    Two digit characters
-        :return:            Character code integer
-        """
-        return int(two_chars)
+    # patterns as runs of bars and spaces, see pattern_runs
+    pattern_runs_table = tuple(
+        map(BarcodeEncoding.pattern_runs, pattern, repeat(code_bitlength))
+    )
+    stop_runs = BarcodeEncoding.pattern_runs(stop, stop_bitlength)
 
-    @classmethod
-    def _encode_one(cls, alphabet, s):
-        """Encode a character or pair of digits into character code
-of chosen alphabet
-
-        :param str alphabet: "A", "B" or "C" alphabet
-        :param str s:        Character or pair of digits
-        :return:             Character code (integer)"""
-        if alphabet == "A":
-            return cls._enc_A(s)
-        elif alphabet == "B":
-            return cls._enc_B(s)
-        elif alphabet == "C":
-            return cls._enc_C(s)
-        raise ValueError("Unknown encoding: {!r}".format(alphabet))
+    # codes of characters of code sets A and B indexed by ordinal, and
+    # str.translate tables from character to character with ordinal
+    # of its code
+    codes_A = tuple(i + 64 if i < 32 else i - 32 for i in range(96))
+    codes_B = tuple(i - 32 if i >= 32 else None for i in range(128))
+    translation_A = dict(enumerate(map(chr, codes_A)))
+    translation_B = {i: chr(i - 32) for i in range(32, 128)}
 
     @classmethod
     def encode_A(cls, s):
+        cls.check_characters(s, _invalid["A"], "code128A")
         yield cls.start_A
-        for char in s:
-            yield cls._enc_A(char)
+        yield from s.translate(cls.translation_A).encode("latin-1")
 
     @classmethod
     def encode_B(cls, s):
+        cls.check_characters(s, _invalid["B"], "code128B")
         yield cls.start_B
-        for char in s:
-            yield cls._enc_B(char)
+        yield from s.translate(cls.translation_B).encode("latin-1")
 
     @classmethod
     def encode_C(cls, s):
         if len(s) & 1 == 1:
             raise ValueError("String length must be even")
+        cls.check_characters(s, _invalid["C"], "code128C")
         yield cls.start_C
         for i in range(0, len(s), 2):
-            two_chars = int(s[i:i + 2])
-            yield cls._enc_C(two_chars)
+            yield int(s[i:i + 2])
 
     @classmethod
-    def bars(cls, s, encoding="B"):
-        """Encodes string to series of bits, 1 for black bar,
-0 for background according to selected encoding.
+    def encode_auto(cls, s):
+        """Encodes string choosing start code, code set switches and
+shifts that give the least number of codes
+
+        Costs are computed from the end of string, cost of position
+        and code set being the least number of codes encoding the rest
+        of string with the code set active at that position.
+
+        :param str s:       String of characters to encode
+        :return:            Yields codes, start code first"""
+        cls.check_characters(s, _invalid["auto"], "code128")
+        length = len(s)
+        chars = s.encode("ascii")
+        # costs with code sets A, B and C active, cost of code set that
+        # can't encode the character is higher than any real cost
+        impossible = length * 3 + 2
+        costs = [(0, 0, 0)] * (length + 1)
+        # code set to encode the character in, for each active code set
+        choices = [None] * length
+        for i in range(length - 1, -1, -1):
+            char = chars[i]
+            cost_a, cost_b, cost_c = costs[i + 1]
+            # shift encodes single character of the other code set
+            cost_a += 1 if char < 96 else 2
+            cost_b += 1 if char >= 32 else 2
+            if 48 <= char <= 57 and i + 1 < length and \
+                    48 <= chars[i + 1] <= 57:
+                cost_c = costs[i + 2][2] + 1
+            else:
+                cost_c = impossible
+            least = min(cost_a, cost_b, cost_c)
+            best = 0 if cost_a == least else 1 if cost_b == least else 2
+            # switching costs a code, stay unless switching saves more
+            choice = (
+                0 if cost_a <= least + 1 else best,
+                1 if cost_b <= least + 1 else best,
+                2 if cost_c <= least + 1 else best
+            )
+            choices[i] = choice
+            costs[i] = (
+                cost_a if choice[0] == 0 else least + 1,
+                cost_b if choice[1] == 1 else least + 1,
+                cost_c if choice[2] == 2 else least + 1
+            )
+        # start code set, B preferred on ties
+        code_set = min((1, 2, 0), key=costs[0].__getitem__)
+        yield (cls.start_A, cls.start_B, cls.start_C)[code_set]
+        switches = {
+            (0, 1): cls.switch_A_to_B,
+            (0, 2): cls.switch_A_to_C,
+            (1, 0): cls.switch_B_to_A,
+            (1, 2): cls.switch_B_to_C,
+            (2, 0): cls.switch_C_to_A,
+            (2, 1): cls.switch_C_to_B
+        }
+        codes_A = cls.codes_A
+        codes_B = cls.codes_B
+        i = 0
+        while i < length:
+            best = choices[i][code_set]
+            if best != code_set:
+                yield switches[(code_set, best)]
+                code_set = best
+            char = chars[i]
+            if code_set == 2:
+                yield (char - 48) * 10 + chars[i + 1] - 48
+                i += 2
+                continue
+            if code_set == 0:
+                if char >= 96:
+                    yield cls.shift_A_to_B
+                    yield codes_B[char]
+                else:
+                    yield codes_A[char]
+            elif char < 32:
+                yield cls.shift_B_to_A
+                yield codes_A[char]
+            else:
+                yield codes_B[char]
+            i += 1
+
+    @classmethod
+    def encoder(cls, encoding):
+        """Returns method encoding string to codes in given encoding
 
-    :param s:               data to encode
-    :param encoding:        string "A", "B", or "C"
-    :return:                Yields bits of barcode (0/1)"""
+        :param encoding:        string "A", "B", "C" or "auto"
+        :return:                Method yielding codes, start code first"""
         encodings = {
             "A": cls.encode_A,
             "B": cls.encode_B,
             "C": cls.encode_C,
+            "auto": cls.encode_auto
         }
         enc = encodings.get(encoding, None)
         if enc is None:
             raise ValueError("Unsupported encoding {!r}".format(encoding))
-        codes = enc(s)
-        yield from cls.bits(0, 10)
-        checksum = 0
-        for i, n in enumerate(codes):
-            yield from cls.bits(cls.pattern[n], cls.code_bitlength)
-            checksum += n * max([1, i])
-        checksum %= 103
-        yield from cls.bits(cls.pattern[checksum], cls.code_bitlength)
-        yield from cls.bits(cls.stop, 13)
-        yield from cls.bits(0, 10)
+        return enc
+
+    @classmethod
+    def symbol_codes(cls, s, encoding="B"):
+        """Encodes string to codes of symbol, start code and checksum
+included, stop excluded
+
+        :param s:               data to encode
+        :param encoding:        string "A", "B", "C" or "auto"
+        :return:                list of codes"""
+        enc = cls.encoder(encoding)
+        codes = list(enc(s))
+        checksum = codes[0]
+        for i, n in enumerate(codes[1:], 1):
+            checksum += n * i
+        codes.append(checksum % 103)
+        return codes
+
+    @classmethod
+    def bars(cls, s, encoding="B"):
+        """Encodes string to series of bits, 1 for black bar,
+0 for background according to selected encoding.
+
+        :param s:               data to encode
+        :param encoding:        string "A", "B", "C" or "auto"
+        :return:                Yields bits of barcode (0/1)"""
+        yield from cls.bits(*cls.to_int(s, encoding))
+
+    @classmethod
+    def to_int(cls, s, encoding="B"):
+        """Encodes string to modules packed into int, see bars and
+BarcodeEncoding.to_int"""
+        pattern = cls.pattern
+        code_bitlength = cls.code_bitlength
+        codes = cls.symbol_codes(s, encoding)
+        row = 0
+        for n in codes:
+            row = (row << code_bitlength) | pattern[n]
+        row = (row << cls.stop_bitlength) | cls.stop
+        row <<= cls.quiet_zone_width
+        width = len(codes) * code_bitlength + cls.stop_bitlength + \
+            2 * cls.quiet_zone_width
+        return (row, width)
+
+    @classmethod
+    def widths(cls, s, encoding="B"):
+        """Encodes string to widths of alternating spaces and bars,
+see bars and BarcodeEncoding.widths"""
+        runs = cls.pattern_runs_table
+        yield cls.quiet_zone_width
+        for n in cls.symbol_codes(s, encoding):
+            # every symbol starts with bar and ends with space
+            yield from runs[n][1]
+        yield from cls.stop_runs[1]
+        yield cls.quiet_zone_width
+
+    @classmethod
+    def module_count(cls, s, encoding="B"):
+        """Number of modules of barcode, see bars"""
+        enc = cls.encoder(encoding)
+        # start code and data codes, followed by checksum
+        code_count = sum(1 for _ in enc(s)) + 1
+        return code_count * cls.code_bitlength + cls.stop_bitlength + \
+            2 * cls.quiet_zone_width
+
+    @classmethod
+    def quiet_zone(cls, s):
+        return (cls.quiet_zone_width, cls.quiet_zone_width)
     
     @classmethod
     def label_text_areas(cls, data, bar_width):
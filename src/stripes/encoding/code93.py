@@ -1,6 +1,12 @@
+import re
+from itertools import repeat
+
 from .encoding import BarcodeEncoding
 
 
+_invalid = re.compile("[^\x00-\x7f]")
+
+
 class Code93(BarcodeEncoding):
     """Encoder for Code93 barcodes."""
     # stripe patterns, 1 for black, 0 for background white
@@ -32,6 +38,15 @@ class Code93(BarcodeEncoding):
 
     code_bitlength = 9
 
+    # patterns as runs of bars and spaces, see pattern_runs
+    pattern_runs_table = tuple(
+        map(BarcodeEncoding.pattern_runs, pattern, repeat(code_bitlength))
+    )
+
+    # str.translate table from ASCII character to string of characters
+    # with ordinals of its codes, built on first use
+    _translation_table = None
+
     # bits = partial(bits, length=code_bitlength)
 
     @classmethod
@@ -96,47 +111,111 @@ class Code93(BarcodeEncoding):
         else:
             raise ValueError("Code93 encoding implementation error!")
 
+    @classmethod
+    def _encode_char(cls, char):
+        """Encodes single character
+
+    :param str char:    string of length one to encode
+    :return:            yields character code, preceded by escape code
+                        where needed"""
+        if "0" <= char <= "9":
+            yield int(char)
+        elif "A" <= char <= "Z":
+            yield from cls._encode_upper(char)
+        elif "a" <= char <= "z":
+            yield from cls._encode_lower(char)
+        else:
+            yield from cls._encode_other(char)
+
+    @classmethod
+    def translation_table(cls):
+        """Returns str.translate table mapping every ASCII character
+to string of characters with ordinals of its codes, full ASCII escape
+code first"""
+        if cls._translation_table is None:
+            cls._translation_table = {
+                i: "".join(map(chr, cls._encode_char(chr(i))))
+                for i in range(128)
+            }
+        return cls._translation_table
+
     @classmethod
     def encode(cls, s):
         """Encodes string to array of codes
 
     :param str s:       String of characters to encode
-    :return:            Array of codes"""
-        for char in s:
-            if char.isnumeric():
-                yield int(char)
-            elif char.isupper():
-                yield from cls._encode_upper(char)
-            elif char.islower():
-                yield from cls._encode_lower(char)
-            else:
-                yield from cls._encode_other(char)
+    :return:            bytes of codes"""
+        cls.check_characters(s, _invalid, "Code93")
+        return s.translate(cls.translation_table()).encode("latin-1")
 
     @classmethod
-    def bars(cls, s):
-        """Encodes string to series of bits, 1 for black bar, 0 for background
+    def symbol_codes(cls, s):
+        """Encodes string to codes of symbol, start, checksums and stop
+included
 
     :param str s:           Data to encode
-    :return:                Array of bits (0, 1 values)"""
-        codes = list(cls.encode(s))
+    :return:                list of codes"""
+        codes = cls.encode(s)
         weight = len(codes)
         checksum1 = 0
         checksum2 = 0
-        yield from cls.bits(0, cls.code_bitlength + 1)
-        yield from cls.bits(cls.pattern[cls.start], cls.code_bitlength)
         for code in codes:
-            yield from cls.bits(cls.pattern[code], cls.code_bitlength)
             checksum1 += weight * code
             checksum2 += (weight + 1) * code
             weight -= 1
         checksum2 += checksum1
         checksum1 %= 47
         checksum2 %= 47
-        yield from cls.bits(cls.pattern[checksum1], cls.code_bitlength)
-        yield from cls.bits(cls.pattern[checksum2], cls.code_bitlength)
-        yield from cls.bits(cls.pattern[cls.stop], cls.code_bitlength)
-        yield from cls.bits(1, 1)
-        yield from cls.bits(0, cls.code_bitlength + 1)
+        return [cls.start] + list(codes) + [checksum1, checksum2, cls.stop]
+
+    @classmethod
+    def bars(cls, s):
+        """Encodes string to series of bits, 1 for black bar, 0 for background
+
+    :param str s:           Data to encode
+    :return:                Array of bits (0, 1 values)"""
+        yield from cls.bits(*cls.to_int(s))
+
+    @classmethod
+    def to_int(cls, s):
+        """Encodes string to modules packed into int, see bars and
+BarcodeEncoding.to_int"""
+        pattern = cls.pattern
+        code_bitlength = cls.code_bitlength
+        codes = cls.symbol_codes(s)
+        row = 0
+        for code in codes:
+            row = (row << code_bitlength) | pattern[code]
+        # termination bar and quiet zone
+        row = ((row << 1) | 1) << (code_bitlength + 1)
+        width = len(codes) * code_bitlength + 1 + 2 * (code_bitlength + 1)
+        return (row, width)
+
+    @classmethod
+    def widths(cls, s):
+        """Encodes string to widths of alternating spaces and bars,
+see bars and BarcodeEncoding.widths"""
+        runs = cls.pattern_runs_table
+        yield cls.code_bitlength + 1
+        for code in cls.symbol_codes(s):
+            # every symbol starts with bar and ends with space
+            yield from runs[code][1]
+        # termination bar
+        yield 1
+        yield cls.code_bitlength + 1
+
+    @classmethod
+    def module_count(cls, s):
+        """Number of modules of barcode, see bars"""
+        # start, data codes, two checksums and stop
+        code_count = len(cls.encode(s)) + 4
+        # termination bar
+        return code_count * cls.code_bitlength + 1 + \
+            2 * (cls.code_bitlength + 1)
+
+    @classmethod
+    def quiet_zone(cls, s):
+        return (cls.code_bitlength + 1, cls.code_bitlength + 1)
 
     @classmethod
     def label_text_areas(cls, data):
@@ -1,4 +1,4 @@
-from itertools import chain
+from itertools import chain, repeat
 
 from .encoding import BarcodeEncoding
 
@@ -20,6 +20,16 @@ class Ean(BarcodeEncoding):
 
     code_bitlength = 7
 
+    # patterns as runs of bars and spaces, see pattern_runs,
+    # L, G and R pattern of digit d at index 3 * d, 3 * d + 1, 3 * d + 2
+    pattern_runs_table = tuple(map(
+        BarcodeEncoding.pattern_runs,
+        chain.from_iterable(patterns),
+        repeat(code_bitlength)
+    ))
+    guard_runs = BarcodeEncoding.pattern_runs(0b101, 3)
+    middle_runs = BarcodeEncoding.pattern_runs(0b01010, 5)
+
     # EAN13 constants
     quiet_zone_left_ean13 = 13
     quiet_zone_right_ean13 = 8
@@ -74,56 +84,154 @@ class Ean(BarcodeEncoding):
         else:
             raise ValueError("Invalid EAN length: {}. ".format(length))
 
+    @classmethod
+    def widths(cls, number_sequence):
+        """Encodes digits to widths of alternating spaces and bars,
+see bars and BarcodeEncoding.widths"""
+        length = len(number_sequence)
+        if length == 12 or length == 13:
+            yield from cls.ean13_widths(number_sequence)
+        elif length == 7 or length == 8:
+            yield from cls.ean8_widths(number_sequence)
+        else:
+            raise ValueError("Invalid EAN length: {}. ".format(length))
+
+    @classmethod
+    def quiet_zone(cls, number_sequence):
+        length = len(number_sequence)
+        if length == 12 or length == 13:
+            return (cls.quiet_zone_left_ean13, cls.quiet_zone_right_ean13)
+        elif length == 7 or length == 8:
+            return (cls.quiet_zone_left_ean8, cls.quiet_zone_right_ean8)
+        raise ValueError("Invalid EAN length: {}. ".format(length))
+
+    @classmethod
+    def module_count(cls, number_sequence):
+        """Number of modules of barcode, see bars"""
+        left, right = cls.quiet_zone(number_sequence)
+        # first digit of EAN13 is encoded only in the choice of L and G
+        # patterns, leaving 12 symbol characters, same as length of EAN8
+        symbols = 8 if len(number_sequence) <= 8 else 12
+        # guard patterns on both ends and in the middle
+        return left + 3 + symbols * cls.code_bitlength + 5 + 3 + right
+
     @classmethod
     def ean13_bars(cls, number_sequence):
+        yield from cls.bits(*cls.ean13_to_int(number_sequence))
+
+    @classmethod
+    def ean8_bars(cls, number_sequence):
+        yield from cls.bits(*cls.ean8_to_int(number_sequence))
+
+    @classmethod
+    def to_int(cls, number_sequence):
+        """Encodes digits to modules packed into int, see bars
+and BarcodeEncoding.to_int"""
+        length = len(number_sequence)
+        if length == 12 or length == 13:
+            return cls.ean13_to_int(number_sequence)
+        elif length == 7 or length == 8:
+            return cls.ean8_to_int(number_sequence)
+        raise ValueError("Invalid EAN length: {}. ".format(length))
+
+    @classmethod
+    def _join_patterns(cls, left, right, quiet_zone_right):
+        """Joins left and right half digit patterns with guards
+
+        :return:            tuple of (int of modules without left quiet
+                            zone, number of modules)"""
+        code_bitlength = cls.code_bitlength
+        row = 0b101
+        for pattern in left:
+            row = (row << code_bitlength) | pattern
+        row = (row << 5) | 0b01010
+        for pattern in right:
+            row = (row << code_bitlength) | pattern
+        row = ((row << 3) | 0b101) << quiet_zone_right
+        width = 3 + (len(left) + len(right)) * code_bitlength + 5 + 3 + \
+            quiet_zone_right
+        return (row, width)
+
+    @classmethod
+    def ean13_to_int(cls, number_sequence):
         check_digit = cls.check_digit(number_sequence)
-        it = iter(number_sequence)
-        first_digit = int(next(it))
-        lg_pattern = cls.lg_pattern_ean13[first_digit]
+        digits = [int(char) for char in number_sequence[:12]]
+        digits.append(check_digit)
+        lg_pattern = cls.lg_pattern_ean13[digits[0]]
+        patterns = cls.patterns
+        left = [
+            patterns[number][(lg_pattern >> (5 - i)) & 1]
+            for i, number in enumerate(digits[1:7])
+        ]
+        right = [patterns[number][2] for number in digits[7:]]
+        row, width = cls._join_patterns(
+            left,
+            right,
+            cls.quiet_zone_right_ean13
+        )
+        return (row, width + cls.quiet_zone_left_ean13)
 
-        yield from cls.bits(0, cls.quiet_zone_left_ean13)
-        # barcode start
-        yield from cls.bits(0b101, 3)
+    @classmethod
+    def ean8_to_int(cls, number_sequence):
+        check_digit = cls.check_digit(number_sequence)
+        digits = [int(char) for char in number_sequence[:7]]
+        digits.append(check_digit)
+        patterns = cls.patterns
+        left = [patterns[number][0] for number in digits[:4]]
+        right = [patterns[number][2] for number in digits[4:]]
+        row, width = cls._join_patterns(
+            left,
+            right,
+            cls.quiet_zone_right_ean8
+        )
+        return (row, width + cls.quiet_zone_left_ean8)
 
-        for i, number in zip(range(11), (int(char) for char in it)):
-            if i < 6:
-                lgr_index = (lg_pattern >> (5 - i)) & 1
-            else:
-                lgr_index = 2
-            yield from cls.bits(
-                cls.patterns[number][lgr_index],
-                cls.code_bitlength
-            )
-            if i == 5:
-                # middle separator, between first 6 and last 6 digits
-                yield from cls.bits(0b01010, 5)
+    @classmethod
+    def _join_halves(cls, quiet_zone_left, left, right, quiet_zone_right):
+        """Yields widths of symbol made of runs of left and right
+half digit patterns"""
+        yield from cls.join_widths(chain(
+            ((0, (quiet_zone_left,)), cls.guard_runs),
+            left,
+            (cls.middle_runs,),
+            right,
+            (cls.guard_runs, (0, (quiet_zone_right,)))
+        ))
 
-        yield from cls.bits(cls.patterns[check_digit][2], cls.code_bitlength)
-        yield from cls.bits(0b101, 3)
-        yield from cls.bits(0, cls.quiet_zone_right_ean13)
-    
     @classmethod
-    def ean8_bars(cls, number_sequence):
-        if isinstance(number_sequence, str):
-            number_sequence = [ord(c) - ord('0') for c in number_sequence]
+    def ean13_widths(cls, number_sequence):
         check_digit = cls.check_digit(number_sequence)
-        
-        yield from cls.bits(0, cls.quiet_zone_left_ean8)
-        yield from cls.bits(0b101, 3)
-        
-        for i, number in zip(range(7), number_sequence):
-            lgr_index = 0 if i < 4 else 2
-            yield from cls.bits(
-                cls.patterns[number][lgr_index],
-                cls.code_bitlength
-            )
-            if i == 3:
-                yield from cls.bits(0b01010, 5)
+        digits = [int(char) for char in number_sequence[:12]]
+        digits.append(check_digit)
+        lg_pattern = cls.lg_pattern_ean13[digits[0]]
+        runs = cls.pattern_runs_table
+        left = [
+            runs[3 * number + ((lg_pattern >> (5 - i)) & 1)]
+            for i, number in enumerate(digits[1:7])
+        ]
+        right = [runs[3 * number + 2] for number in digits[7:]]
+        return cls._join_halves(
+            cls.quiet_zone_left_ean13,
+            left,
+            right,
+            cls.quiet_zone_right_ean13
+        )
+
+    @classmethod
+    def ean8_widths(cls, number_sequence):
+        check_digit = cls.check_digit(number_sequence)
+        digits = [int(char) for char in number_sequence[:7]]
+        digits.append(check_digit)
+        runs = cls.pattern_runs_table
+        left = [runs[3 * number] for number in digits[:4]]
+        right = [runs[3 * number + 2] for number in digits[4:]]
+        return cls._join_halves(
+            cls.quiet_zone_left_ean8,
+            left,
+            right,
+            cls.quiet_zone_right_ean8
+        )
 
-        yield from cls.bits(cls.patterns[check_digit][2], cls.code_bitlength)
-        yield from cls.bits(0b101, 3)
-        yield from cls.bits(0, cls.quiet_zone_left_ean8)
-    
     @classmethod
     def label_text_areas(cls, number_sequence):
         number_sequence = cls.with_check_digit(number_sequence)
@@ -10,10 +10,87 @@ class BarcodeEncoding(ABC):
         for shift in range(bit_length - 1, -1, -1):
             yield (number >> shift) & 1
 
+    @classmethod
+    def check_characters(cls, data, invalid, name):
+        """Raises ValueError listing every character of data that
+can't be encoded, all of them found in one pass
+
+        :param str data:        Data to encode
+        :param invalid:         Compiled regular expression matching
+                                a character that can't be encoded
+        :param str name:        Name of encoding for error message"""
+        bad = [
+            "{!r} at {}".format(match.group(), match.start())
+            for match in invalid.finditer(data)
+        ]
+        if bad:
+            raise ValueError(
+                "Characters can't be encoded in {}: {}".format(
+                    name,
+                    ", ".join(bad)
+                )
+            )
+
+    @classmethod
+    def pattern_runs(cls, number, bit_length):
+        """Splits bit pattern into runs of the same color
+
+        :param int number:      Pattern, 1 bit for black, most
+                                significant bit first
+        :param int bit_length:  Number of bits of pattern
+        :return:                tuple of (color of first run, tuple
+                                of run widths)"""
+        digits = format(number, "0{}b".format(bit_length))
+        widths = []
+        start = 0
+        for i in range(1, bit_length + 1):
+            if i == bit_length or digits[i] != digits[start]:
+                widths.append(i - start)
+                start = i
+        return (int(digits[0]), tuple(widths))
+
+    @classmethod
+    def join_widths(cls, runs):
+        """Joins runs of consecutive patterns into alternating widths,
+merging runs of the same color where patterns meet
+
+        :param runs:            Iterable of pattern runs, see pattern_runs
+        :return:                Yields widths of alternating white
+                                and black runs, starting with white"""
+        color = 0
+        pending = 0
+        for first, widths in runs:
+            if first == color:
+                pending += widths[0]
+            else:
+                yield pending
+                pending = widths[0]
+            if len(widths) > 1:
+                yield pending
+                yield from widths[1:-1]
+                pending = widths[-1]
+            color = first ^ ((len(widths) - 1) & 1)
+        yield pending
+
     @abstractmethod
     def bars(self, data, **extra):
         raise NotImplementedError
 
+    @abstractmethod
+    def to_int(self, data, **extra):
+        """Encodes data to all modules packed into one int, leftmost
+module being the most significant bit, same modules as bars
+
+        :return:                tuple of (int of modules, number
+                                of modules)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def widths(self, data, **extra):
+        """Yields widths of alternating white and black runs of modules,
+starting with white quiet zone, same modules as bars"""
+        raise NotImplementedError
+
     @abstractmethod
     def label_text_areas(self, data):
         raise NotImplementedError
@@ -21,3 +98,35 @@ class BarcodeEncoding(ABC):
     @classmethod
     def label_mask(cls, data):
         return None
+
+    @abstractmethod
+    def module_count(self, data, **extra):
+        """Number of modules of encoded data including quiet zones"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def quiet_zone(self, data):
+        """Widths of left and right quiet zone in modules"""
+        raise NotImplementedError
+
+    @classmethod
+    def plan(cls, data, scale=2, barcode_height=50, label_height=0,
+             **extra):
+        """Computes dimensions of barcode image without encoding bars
+
+        :param data:            Data to encode
+        :param int scale:       Bar width in pixels
+        :param int barcode_height:  Height of bars in pixels
+        :param int label_height:    Height of label in pixels
+        :param extra:           Encoder options, as accepted by bars
+        :return:                dict with modules of the symbol without
+                                quiet zones, quiet_zone widths, width
+                                and height"""
+        total = cls.module_count(data, **extra)
+        quiet_zone = cls.quiet_zone(data)
+        return {
+            "modules": total - sum(quiet_zone),
+            "quiet_zone": quiet_zone,
+            "width": total * scale,
+            "height": barcode_height + label_height
+        }
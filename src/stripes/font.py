@@ -55,6 +55,13 @@ class Font:
             return result
 
     def render_text(self, text, canvas, x_offset=0, y_offset=0, size_coeff=1):
+        """Paints text into canvas
+
+        :param str text:        Text to render
+        :param canvas:          Bitmap with rows not repeated
+        :param int x_offset:    Position of left edge of text
+        :param int y_offset:    Position of top edge of text
+        :param int size_coeff:  Font scale"""
         x = x_offset
         y = y_offset
         for char in text:
@@ -64,14 +71,11 @@ class Font:
                     "Font can't render character {!r}.".format(char)
                 )
             for v, line in enumerate(repeat(char_model, size_coeff), y):
-                for h, value in enumerate(repeat(line, size_coeff), x):
-                    try:
-                        canvas[v][h] |= value
-                    except IndexError:
-                        print("len(canvas), v:", len(canvas), v)
-                        print("len(canvas[0]), h:", len(canvas[0]), h)
-                        raise ValueError
-
+                pixels = "".join(
+                    "1" if value else "0"
+                    for value in repeat(line, size_coeff)
+                )
+                canvas.draw(x, v, int(pixels, 2), len(pixels))
             x += (self.width + self.space) * size_coeff
     
     def render_text_areas(self, label_text_areas, canvas, bar_width=2):
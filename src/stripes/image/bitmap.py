@@ -0,0 +1,271 @@
+import re
+
+
+_expansion_tables = {}
+
+# pixel byte to binary digit, any non-zero pixel is black
+_binary_digits = bytes([48] + [49] * 255)
+
+_black_runs = re.compile("1+")
+
+
+def expansion_table(scale, depth=1):
+    """Returns table widening a byte of eight 1 bit pixels
+
+    Every pixel is repeated scale times and stored in depth bits, black
+pixel as 1, so every byte widens to whole scale * depth bytes and rows
+are widened a byte at a time whatever the scale.
+
+    :param int scale:       Number of times every pixel is repeated
+    :param int depth:       Bits per pixel of widened row
+    :return:                list of 256 bytes objects"""
+    table = _expansion_tables.get((scale, depth))
+    if table is None:
+        pixel_bits = scale * depth
+        black = int("1".zfill(depth) * scale, 2)
+        table = []
+        for value in range(256):
+            widened = 0
+            for shift in range(7, -1, -1):
+                widened <<= pixel_bits
+                if (value >> shift) & 1:
+                    widened |= black
+            table.append(widened.to_bytes(pixel_bits, "big"))
+        _expansion_tables[(scale, depth)] = table
+    return table
+
+
+def widen(row, width, scale, depth=1):
+    """Widens packed row of 1 bit pixels
+
+    :param row:             Packed row, bytes-like, padded with zero bits
+    :param int width:       Number of pixels in row
+    :param int scale:       Number of times every pixel is repeated
+    :param int depth:       Bits per pixel of widened row
+    :return:                bytes of widened row, padded with zero bits"""
+    size = (width * scale * depth + 7) // 8
+    if scale == 1 and depth == 1:
+        return bytes(row[:size])
+    table = expansion_table(scale, depth)
+    return b"".join(map(table.__getitem__, row))[:size]
+
+
+class Bitmap:
+    """Black and white image with one bit per pixel, 1 for black
+
+    Rows are packed into a single bytearray, leftmost pixel in the most
+significant bit, each row padded with zero bits to stride bytes. Every
+stored row carries number of times it repeats vertically, so a linear
+barcode is a single row repeated for its whole height and modules
+of a scaled 2D barcode are not copied for every pixel row.
+    """
+
+    def __init__(self, width, height=0, stride=None):
+        """Creates a bitmap of white rows, each repeated once
+
+        :param int width:       Width in pixels
+        :param int height:      Number of rows
+        :param int stride:      Size of row in bytes, at least enough
+                                for width bits"""
+        min_stride = (width + 7) // 8
+        if stride is None:
+            stride = min_stride
+        elif stride < min_stride:
+            raise ValueError(
+                "Stride {} too small for width {}".format(stride, width)
+            )
+        self.width = width
+        self.stride = stride
+        self.data = bytearray(stride * height)
+        self.repeats = [1] * height
+
+    @classmethod
+    def from_bits(cls, bits, repeat=1):
+        """Creates a bitmap of single row
+
+        :param bits:            Iterable of pixels, 1 for black, 0 for white,
+                                any pixel 0 - 255 other than 0 is black
+        :param int repeat:      Number of times the row repeats"""
+        row = bytes(bits).translate(_binary_digits)
+        bitmap = cls(len(row))
+        bitmap.append(int(row or "0", 2), repeat)
+        return bitmap
+
+    @classmethod
+    def from_widths(cls, widths, repeat=1):
+        """Creates a bitmap of single row given by runs of pixels
+
+        :param widths:          Iterable of widths of alternating white
+                                and black runs, starting with white
+        :param int repeat:      Number of times the row repeats"""
+        row = "".join(
+            ("1" if index & 1 else "0") * width
+            for index, width in enumerate(widths)
+        )
+        bitmap = cls(len(row))
+        bitmap.append(int(row or "0", 2), repeat)
+        return bitmap
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Creates a bitmap from rows of pixels
+
+        :param rows:            Iterable of iterables of pixels,
+                                1 for black, 0 for white, see from_bits"""
+        rows = [bytes(row).translate(_binary_digits) for row in rows]
+        return cls.from_ints(
+            [int(row or "0", 2) for row in rows],
+            len(rows[0]) if rows else 0
+        )
+
+    @classmethod
+    def from_ints(cls, rows, width):
+        """Creates a bitmap from rows given as ints
+
+        :param rows:            Iterable of row ints, leftmost pixel being
+                                the most significant bit
+        :param int width:       Width in pixels"""
+        bitmap = cls(width)
+        for row in rows:
+            bitmap.append(row)
+        return bitmap
+
+    @property
+    def height(self):
+        """Height in pixels, repetitions included"""
+        return sum(self.repeats)
+
+    @property
+    def padding(self):
+        """Number of zero bits after last pixel of row"""
+        return 8 * self.stride - self.width
+
+    def append(self, row, repeat=1):
+        """Appends a row
+
+        :param int row:         Row int, leftmost pixel being
+                                the most significant bit
+        :param int repeat:      Number of times the row repeats"""
+        self.data += (row << self.padding).to_bytes(self.stride, "big")
+        self.repeats.append(repeat)
+
+    def extend(self, bitmap):
+        """Appends all rows of a bitmap of the same width and stride"""
+        if bitmap.width != self.width or bitmap.stride != self.stride:
+            raise ValueError("Bitmaps of different widths can't be joined")
+        self.data += bitmap.data
+        self.repeats.extend(bitmap.repeats)
+
+    def row(self, index):
+        """Returns packed bytes of stored row as memoryview"""
+        start = index * self.stride
+        return memoryview(self.data)[start:start + self.stride]
+
+    def row_int(self, index):
+        """Returns stored row as int, leftmost pixel being the most
+significant bit"""
+        start = index * self.stride
+        row = int.from_bytes(self.data[start:start + self.stride], "big")
+        return row >> self.padding
+
+    def rows(self):
+        """Yields tuples of (packed row, number of repetitions)"""
+        for index, repeat in enumerate(self.repeats):
+            yield (self.row(index), repeat)
+
+    def memoryview(self):
+        """Returns memoryview of packed rows, each stored row once"""
+        return memoryview(self.data)
+
+    def draw(self, x, y, pixels, length):
+        """Paints black pixels over a stored row
+
+        :param int x:           Position of first pixel
+        :param int y:           Index of stored row
+        :param int pixels:      Pixels as int, leftmost pixel being
+                                the most significant bit
+        :param int length:      Number of pixels"""
+        if x < 0 or y < 0 or x + length > self.width or \
+                y >= len(self.repeats):
+            raise ValueError(
+                "Pixels at ({}, {}) don't fit into {}x{} bitmap".format(
+                    x, y, self.width, len(self.repeats)
+                )
+            )
+        row = self.row_int(y) | (pixels << (self.width - x - length))
+        start = y * self.stride
+        self.data[start:start + self.stride] = \
+            (row << self.padding).to_bytes(self.stride, "big")
+
+    def scaled(self, scale_x, scale_y=None):
+        """Returns bitmap with every pixel widened scale_x times and every
+row repeated scale_y times more"""
+        if scale_y is None:
+            scale_y = scale_x
+        bitmap = Bitmap(self.width * scale_x)
+        bitmap.data = bytearray(b"".join(
+            widen(self.row(index), self.width, scale_x)
+            for index in range(len(self.repeats))
+        ))
+        bitmap.repeats = [repeat * scale_y for repeat in self.repeats]
+        return bitmap
+
+    def inverted(self):
+        """Returns bitmap with black and white swapped, padding bits
+stay zero"""
+        bitmap = Bitmap(self.width, 0, self.stride)
+        row_mask = (((1 << self.width) - 1) << self.padding).to_bytes(
+            self.stride,
+            "big"
+        )
+        size = len(self.data)
+        mask = int.from_bytes(row_mask * len(self.repeats), "big")
+        bitmap.data = bytearray(
+            (int.from_bytes(self.data, "big") ^ mask).to_bytes(size, "big")
+        )
+        bitmap.repeats = list(self.repeats)
+        return bitmap
+
+    def unpacked_row(self, index, scale=1):
+        """Returns stored row as bytes, one byte of 0 or 1 per pixel
+
+        :param int index:       Index of stored row
+        :param int scale:       Number of times every pixel is repeated"""
+        return widen(self.row(index), self.width, scale, 8)
+
+    def unpacked(self, scale=1):
+        """Returns all pixels as bytes, one byte of 0 or 1 per pixel,
+repetitions included
+
+        :param int scale:       Number of times every pixel and every row
+                                is repeated"""
+        return b"".join(
+            row * repeat for row, repeat in self.unpacked_rows(scale)
+        )
+
+    def unpacked_rows(self, scale=1):
+        """Yields stored rows unpacked to one byte per pixel, see
+unpacked_row, each row computed only when needed
+
+        :param int scale:       Number of times every pixel and every row
+                                is repeated
+        :return:                Yields tuples of (bytes of row, number
+                                of repetitions)"""
+        for index, repeat in enumerate(self.repeats):
+            yield (self.unpacked_row(index, scale), repeat * scale)
+
+    def runs(self, index):
+        """Returns black runs of stored row
+
+        :param int index:       Index of stored row
+        :return:                list of tuples of (x, length)"""
+        return self.runs_of(self.row_int(index), self.width)
+
+    @staticmethod
+    def runs_of(row, width):
+        """Returns black runs of row given as int, see runs"""
+        row = format(row, "0{}b".format(width))
+        return [
+            (match.start(), match.end() - match.start())
+            for match in _black_runs.finditer(row)
+        ]
@@ -1,256 +1,571 @@
-from os import SEEK_CUR
-
+from .bitmap import Bitmap
 from .image import BarcodeImage
 
 
+# largest LZW code, GIF codes are at most 12 bits long
+MAX_CODE = 4095
+
+# bits written by LzwEncoder before converting them to bytes
+_FLUSH_BITS = 256
+
+
+class LzwEncoder:
+    """Incremental GIF flavoured LZW compressor
+
+    Dictionary maps (prefix code, next pixel) to a code, keyed by single
+int prefix << 8 | pixel, so matching a longer sequence is one lookup
+per pixel. Codes are packed least significant bit first into an int
+which is converted to bytes whenever _FLUSH_BITS of them are ready.
+
+    Clear is deferred: when all 4096 codes are taken, the full dictionary
+is kept and compression ratio is checked every check_interval pixels.
+Dictionary is cleared only once the ratio gets clearly worse than the
+best one so far, which suits images repeating the same rows all over.
+    """
+
+    def __init__(self, color_bits=8, check_interval=10000,
+                 clear_threshold=0.95):
+        """:param int color_bits:      Bits per pixel, 2 - 8
+        :param int check_interval:  Number of pixels between ratio
+                                    checks of full dictionary
+        :param float clear_threshold:   Dictionary is cleared when ratio
+                                        falls below the best one seen
+                                        times clear_threshold"""
+        assert color_bits >= 2, "Gif can't encode 1 bit per pixel"
+        self.color_bits = color_bits
+        self.clear_code = 1 << color_bits
+        self.end_code = self.clear_code + 1
+        self.check_interval = check_interval
+        self.clear_threshold = clear_threshold
+        self.output = bytearray()
+        self.bit_buffer = 0
+        self.bit_buffer_len = 0
+        self.prefix = None
+        self._reset()
+        # stream starts with clear code
+        self._write(self.clear_code)
+
+    def _reset(self):
+        self.table = {}
+        self.next_code = self.clear_code + 2
+        self.code_length = self.color_bits + 1
+        self.pixels_in = 0
+        self.bits_out = 0
+        self.ratio = 0
+        self.lengths = None
+
+    def _write(self, code):
+        self.bit_buffer |= code << self.bit_buffer_len
+        self.bit_buffer_len += self.code_length
+
+    def _flush_bits(self):
+        full_bytes = self.bit_buffer_len >> 3
+        self.output += (
+            self.bit_buffer & ((1 << (full_bytes << 3)) - 1)
+        ).to_bytes(full_bytes, "little")
+        self.bit_buffer >>= full_bytes << 3
+        self.bit_buffer_len &= 7
+
+    def encode(self, data):
+        """Compresses next part of pixels
+
+        :param data:        bytes-like of pixel indices
+        :return:            bytes of compressed data finished so far"""
+        pixels = iter(memoryview(data).cast("B"))
+        if self.prefix is None:
+            self.prefix = next(pixels, None)
+            if self.prefix is None:
+                return self.take()
+        while True:
+            if self.next_code <= MAX_CODE and \
+                    not self._encode_growing(pixels):
+                break
+            if not self._encode_full(pixels):
+                break
+        return self.take()
+
+    def _encode_growing(self, pixels):
+        """Compresses pixels while dictionary has free codes
+
+        :return:            True if dictionary got full"""
+        table = self.table
+        get = table.get
+        prefix = self.prefix
+        next_code = self.next_code
+        code_length = self.code_length
+        # first code whose addition makes codes one bit longer
+        code_limit = 1 << code_length
+        bit_buffer = self.bit_buffer
+        bit_buffer_len = self.bit_buffer_len
+        output = self.output
+        full = False
+        for pixel in pixels:
+            key = (prefix << 8) | pixel
+            code = get(key)
+            if code is not None:
+                prefix = code
+                continue
+            bit_buffer |= prefix << bit_buffer_len
+            bit_buffer_len += code_length
+            if bit_buffer_len >= _FLUSH_BITS:
+                output += (
+                    bit_buffer & ((1 << _FLUSH_BITS) - 1)
+                ).to_bytes(_FLUSH_BITS >> 3, "little")
+                bit_buffer >>= _FLUSH_BITS
+                bit_buffer_len -= _FLUSH_BITS
+            prefix = pixel
+            table[key] = next_code
+            if next_code == code_limit:
+                code_length += 1
+                code_limit <<= 1
+            next_code += 1
+            if next_code > MAX_CODE:
+                full = True
+                break
+        self.prefix = prefix
+        self.next_code = next_code
+        self.code_length = code_length
+        self.bit_buffer = bit_buffer
+        self.bit_buffer_len = bit_buffer_len
+        return full
+
+    def _encode_full(self, pixels):
+        """Compresses pixels with full dictionary, checking compression
+ratio every check_interval pixels
+
+        :return:            True if dictionary was cleared"""
+        table = self.table
+        get = table.get
+        if self.lengths is None:
+            # number of pixels every code stands for
+            lengths = [1] * (MAX_CODE + 1)
+            for key, code in sorted(table.items(), key=lambda item: item[1]):
+                lengths[code] = lengths[key >> 8] + 1
+            self.lengths = lengths
+        lengths = self.lengths
+        prefix = self.prefix
+        code_length = self.code_length
+        bit_buffer = self.bit_buffer
+        bit_buffer_len = self.bit_buffer_len
+        output = self.output
+        pixels_in = self.pixels_in
+        bits_out = self.bits_out
+        cleared = False
+        for pixel in pixels:
+            code = get((prefix << 8) | pixel)
+            if code is not None:
+                prefix = code
+                continue
+            bit_buffer |= prefix << bit_buffer_len
+            bit_buffer_len += code_length
+            pixels_in += lengths[prefix]
+            bits_out += code_length
+            if bit_buffer_len >= _FLUSH_BITS:
+                output += (
+                    bit_buffer & ((1 << _FLUSH_BITS) - 1)
+                ).to_bytes(_FLUSH_BITS >> 3, "little")
+                bit_buffer >>= _FLUSH_BITS
+                bit_buffer_len -= _FLUSH_BITS
+            prefix = pixel
+            if pixels_in < self.check_interval:
+                continue
+            ratio = pixels_in / bits_out
+            if ratio >= self.ratio * self.clear_threshold:
+                self.ratio = max(ratio, self.ratio)
+                pixels_in = 0
+                bits_out = 0
+                continue
+            # compression got worse, start over with empty dictionary
+            bit_buffer |= self.clear_code << bit_buffer_len
+            bit_buffer_len += code_length
+            cleared = True
+            break
+        self.prefix = prefix
+        self.bit_buffer = bit_buffer
+        self.bit_buffer_len = bit_buffer_len
+        if cleared:
+            self._reset()
+        else:
+            self.pixels_in = pixels_in
+            self.bits_out = bits_out
+        return cleared
+
+    def take(self):
+        """Returns compressed bytes finished so far and forgets them"""
+        output = bytes(self.output)
+        self.output = bytearray()
+        return output
+
+    def finish(self):
+        """Writes pending code and end of data code
+
+        :return:            bytes of remaining compressed data"""
+        if self.prefix is not None:
+            self._write(self.prefix)
+            if self.next_code <= MAX_CODE:
+                # decoder adds an entry for the pending code as well
+                if self.next_code == 1 << self.code_length:
+                    self.code_length += 1
+                self.next_code += 1
+        self._write(self.end_code)
+        self.bit_buffer_len += -self.bit_buffer_len & 7
+        self._flush_bits()
+        return self.take()
+
+
 def compress_gif(data, color_bits=8):
-    assert color_bits >= 2, "Gif can't encode 1 bit per pixel"
-    length = len(data)
-    symbol_length = color_bits + 1
-    reset_table = 2 ** color_bits
-    end_of_data = reset_table + 1
-    init_size = 2 ** color_bits + 2
-    table = {}
-    output = bytearray()
-    bit_buffer = reset_table
-    bit_buffer_len = symbol_length
-    index = 0
-    length = len(data)
-    def out(symbol, symbol_length):
-        nonlocal bit_buffer, bit_buffer_len
-        bit_buffer |= symbol << bit_buffer_len
-        bit_buffer_len += symbol_length
-        while bit_buffer_len >= 8:
-            output.append(bit_buffer & 0xff)
-            bit_buffer >>= 8
-            bit_buffer_len -= 8
-    while index < length:
-        sequence_len = 2
-        sequence = data[index:index + sequence_len]
-        while sequence in table.keys() and index + sequence_len <= length:
-            symbol = table[sequence]
-            sequence_len += 1
-            sequence = data[index:index + sequence_len]
-        if sequence_len == 2:
-            symbol = data[index]
-        out(symbol, symbol_length)
-        table[sequence] = len(table) + init_size
-        index += sequence_len - 1
-        symbol_length = (init_size - 1 + len(table)).bit_length()
-        if len(table) == 4095 - init_size:
-            # resetting dictionary
-            out(reset_table, 12)
-            table = {}
-            symbol_length = color_bits + 1
-    out(end_of_data, symbol_length)
-    if bit_buffer_len > 0:
-        output.append(bit_buffer)
-    return bytes(output)
+    """Compresses pixel indices into GIF image data
+
+    :param data:            bytes-like of pixel indices
+    :param int color_bits:  Bits per pixel, LZW minimum code size
+    :return:                bytes of compressed data, without sub-blocks"""
+    encoder = LzwEncoder(color_bits)
+    return encoder.encode(data) + encoder.finish()
 
 
 def decompress_gif(data, color_bits=8):
-    assert color_bits >= 2, "Gif can't encode 1 bit per pixel"
-    table = [bytes((i,)) for i in range(2 ** color_bits)]
-    table.append(None)
-    table.append(None)
-    reset_table = 2 ** color_bits
-    end_of_data = reset_table + 1
-    symbol_length = color_bits + 1
+    """Decompresses GIF image data into palette indices
+
+    Code table is a list indexed by code holding bytes of every
+sequence, so each code is decoded by a single lookup and new entries
+are made of bytes already decoded.
+
+    :param data:            bytes-like of compressed data, without
+                            sub-blocks
+    :param int color_bits:  LZW minimum code size
+    :return:                bytearray of pixel indices, one per byte"""
+    if not 2 <= color_bits <= 8:
+        raise ValueError("Unsupported LZW code size {}".format(color_bits))
+    clear_code = 1 << color_bits
+    end_code = clear_code + 1
+    table = [bytes((i,)) for i in range(clear_code)]
+    table += [None] * (MAX_CODE + 1 - clear_code)
+    next_code = end_code + 1
+    code_length = color_bits + 1
+    code_mask = (1 << code_length) - 1
     length = len(data)
+    position = 0
     bit_buffer = 0
     bit_buffer_len = 0
-    index = 0
-    def load(bit_length):
-        nonlocal bit_buffer, bit_buffer_len, index
-        while bit_buffer_len < bit_length and index < length:
-            bit_buffer |= data[index] << bit_buffer_len
-            bit_buffer_len += 8
-            index += 1
-        ret = bit_buffer & (2 ** bit_length - 1)
-        bit_buffer >>= bit_length
-        bit_buffer_len -= bit_length
-        return ret
-    assert load(symbol_length) == reset_table
-    prev_sequence = table[load(symbol_length)]
-    if color_bits == 1:
-        symbol_length += 1
+    previous = None
     output = bytearray()
-    while index <= length:
-        table_index = load(symbol_length)
-        if table_index == reset_table:
-            # resetting dictionary...
-            output.extend(sequence)
-            table = [bytes((i,)) for i in range(2 ** color_bits)]
-            table.append((-1,))
-            table.append((-1,))
-            symbol_length = color_bits + 1
-            sequence = table[load(symbol_length)]
-        elif table_index == end_of_data:
-            output.extend(sequence)
-            return bytes(output)
+    while True:
+        if bit_buffer_len < code_length:
+            if position >= length:
+                # end of data code is missing, keep what was decoded
+                break
+            part = data[position:position + 8]
+            bit_buffer |= int.from_bytes(part, "little") << bit_buffer_len
+            bit_buffer_len += len(part) << 3
+            position += 8
+            continue
+        code = bit_buffer & code_mask
+        bit_buffer >>= code_length
+        bit_buffer_len -= code_length
+        if code == clear_code:
+            next_code = end_code + 1
+            code_length = color_bits + 1
+            code_mask = (1 << code_length) - 1
+            previous = None
+            continue
+        if code == end_code:
+            break
+        if code < next_code:
+            sequence = table[code]
+        elif code == next_code and previous is not None:
+            sequence = previous + previous[:1]
         else:
-            if table_index < len(table):
-                sequence = table[table_index]
-                table_sequence = prev_sequence + sequence[:1]
-            else:
-                sequence = prev_sequence + prev_sequence[:1]
-                table_sequence = sequence
-            table.append(table_sequence)
-            output.extend(prev_sequence)
-        symbol_length = len(table).bit_length()
-        prev_sequence = sequence
-    return bytes(output)
+            raise ValueError("Invalid LZW code {}".format(code))
+        if previous is not None and next_code <= MAX_CODE:
+            table[next_code] = previous + sequence[:1]
+            next_code += 1
+            # full dictionary is kept until encoder clears it
+            if next_code > code_mask and code_length < 12:
+                code_length += 1
+                code_mask = (1 << code_length) - 1
+        output += sequence
+        previous = sequence
+    return output
 
 
 magic_number1 = b"GIF87a"
 magic_number2 = b"GIF89a"
 
+# row order of interlaced image as (first row, step) of its four passes
+_interlace_passes = ((0, 8), (4, 8), (2, 4), (1, 2))
+
+
+class GifFrame:
+    """Single image of GIF file, pixels kept as palette indices
+
+    Pixels are stored in a flat bytearray of indices, row after row,
+    and converted to colors or to a Bitmap only on request.
+    """
+
+    def __init__(self, x, y, width, height, indices, color_table,
+                 transparent_color_index=None):
+        """:param int x:           Position of left edge in image
+        :param int y:               Position of top edge in image
+        :param int width:           Width in pixels
+        :param int height:          Height in pixels
+        :param indices:             bytearray of palette indices
+        :param list color_table:    List of (red, green, blue) tuples
+        :param int transparent_color_index: Index of transparent color,
+                                            None if there is none"""
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.indices = indices
+        self.color_table = color_table
+        self.transparent_color_index = transparent_color_index
+
+    def index_rows(self):
+        """Returns rows of palette indices as memoryviews"""
+        view = memoryview(self.indices)
+        width = self.width
+        return [
+            view[start:start + width]
+            for start in range(0, width * self.height, width)
+        ]
+
+    def rgb_rows(self):
+        """Returns rows of pixels as lists of (red, green, blue) tuples"""
+        colors = self.color_table.__getitem__
+        return [list(map(colors, row)) for row in self.index_rows()]
+
+    def bitmap(self):
+        """Returns Bitmap of frame, pixel is black if its color is darker
+than middle grey"""
+        dark = bytes(
+            1 if sum(color) < 384 else 0 for color in self.color_table
+        )
+        dark += bytes(256 - len(dark))
+        return Bitmap.from_rows(
+            self.indices[start:start + self.width].translate(dark)
+            for start in range(0, self.width * self.height, self.width)
+        )
+
 
 class GifImage:
+    """GIF file reader
+
+    Whole file is read at once and parsed from memory. Frames are
+    decoded into GifFrame objects holding palette indices.
+    """
+
     def __init__(self, filename, verbose=False):
         self.filename = filename
-        self.file = open(filename, "rb")
         self.frames = []
         self.comments = []
         self.verbose = verbose
+        self.global_color_table = None
+        self.transparent_color_index = None
+        self.animation_delay = 0
+        with open(filename, "rb") as file:
+            self.data = file.read()
+        self.position = 0
         self.read_file()
 
+    def read(self, size):
+        """Returns next size bytes of file"""
+        start = self.position
+        if start + size > len(self.data):
+            raise ValueError("Unexpected end of gif file")
+        self.position += size
+        return self.data[start:start + size]
+
+    def read_int(self, size=1):
+        """Returns next size bytes of file as little endian int"""
+        return int.from_bytes(self.read(size), "little")
+
     def read_header(self):
-        first_bytes = self.file.read(6)
+        first_bytes = self.read(6)
         if not (first_bytes == magic_number1 or first_bytes == magic_number2):
             raise ValueError("File does not have gif image magic number")
 
     def read_color_table(self, size=None):
         if size is None:
             size = self.global_color_table_size
-        return [tuple(self.file.read(3)) for i in range(2 ** size)]
+        colors = iter(self.read(3 << size))
+        return list(zip(colors, colors, colors))
 
     def read_gce(self):
         data = self.read_block_data()
-        self.has_transparent_color = data[0] & 1
+        if data[0] & 1:
+            self.transparent_color_index = data[3]
+        else:
+            self.transparent_color_index = None
         self.animation_delay = int.from_bytes(data[1:3], "little")
-        self.transparent_color_index = data[3]
 
     def read_anim(self):
         data = self.read_block_data()
-        netscape = data[:11]
-        if netscape != b"NETSCAPE2.0":
+        if data[:11] != b"NETSCAPE2.0":
             raise ValueError("Not an animation")
-        sub_block_index = data[12]
         self.number_of_repetitions = int.from_bytes(data[12:14], "little")
 
-    def read_descriptor(self):
-        self.nw_corner_x = int.from_bytes(self.file.read(2), "little")
-        self.nw_corner_y = int.from_bytes(self.file.read(2), "little")
-        self.image_width = int.from_bytes(self.file.read(2), "little")
-        self.image_height = int.from_bytes(self.file.read(2), "little")
-        byte = ord(self.file.read(1))
-        local_color_table_present = byte >> 7
-        interlace_flag = (byte >> 6) & 1
-        sort_flag = (byte >> 5) & 1
-        local_color_table_size = byte & 0b111
-        b = self.file.read(1)
-        if local_color_table_present:
-            color_table = self.read_color_table(local_color_table_size)
-        else:
-            color_table = None
-        return color_table
+    def read_block_data(self):
+        """Returns data of sub-blocks following current position joined
+together"""
+        data = self.data
+        position = self.position
+        parts = []
+        while True:
+            if position >= len(data):
+                raise ValueError("Truncated GIF sub-block data")
+            part_len = data[position]
+            if part_len == 0:
+                break
+            end = position + 1 + part_len
+            if end > len(data):
+                raise ValueError("Truncated GIF sub-block data")
+            parts.append(data[position + 1:end])
+            position = end
+        self.position = position + 1
+        return b"".join(parts)
 
-    def read_pixels(self, color_table=None):
-        if color_table is None:
-            color_table = self.global_color_table
-        data = self.read_block_data()
-        indexed_pixels = decompress_gif(data, self.color_resolution)
-        pixels = []
-        if self.frames == [] or not self.has_transparent_color:
-            for i in range(self.image_height):
-                start = self.image_width * i
-                end = self.image_width * (i + 1)
-                row = indexed_pixels[start:end]
-                pixels.append([color_table[x] for x in row])
+    def read_frame(self):
+        x = self.read_int(2)
+        y = self.read_int(2)
+        width = self.read_int(2)
+        height = self.read_int(2)
+        flags = self.read_int()
+        if flags >> 7:
+            color_table = self.read_color_table((flags & 0b111) + 1)
         else:
-            pixels = [list(row) for row in self.frames[-1]]
-            for i in range(self.image_height):
-                for j in range(self.image_width):
-                    indexed_index = i * self.image_width + j
-                    color_index = indexed_pixels[indexed_index]
-                    if color_index != self.transparent_color_index:
-                        y = i + self.nw_corner_y
-                        x = j + self.nw_corner_x
-                        pixels[y][x] = color_table[color_index]
-        return pixels
+            color_table = self.global_color_table
+        color_bits = self.read_int()
+        indices = decompress_gif(self.read_block_data(), color_bits)
+        size = width * height
+        if len(indices) < size:
+            # missing pixels take background color
+            indices += bytes((self.background_color_index,)) * \
+                (size - len(indices))
+        del indices[size:]
+        if (flags >> 6) & 1:
+            indices = self.deinterlaced(indices, width, height)
+        frame = GifFrame(
+            x,
+            y,
+            width,
+            height,
+            indices,
+            color_table,
+            self.transparent_color_index
+        )
+        self.transparent_color_index = None
+        return frame
 
-    def read_block_data(self):
-        data = bytearray()
-        part_len = ord(self.file.read(1))
-        while part_len != 0:
-            data.extend(self.file.read(part_len))
-            part_len = ord(self.file.read(1))
-        return data
+    @staticmethod
+    def deinterlaced(indices, width, height):
+        """Returns pixels of interlaced image with rows in display order"""
+        output = bytearray(len(indices))
+        source = 0
+        for first_row, step in _interlace_passes:
+            for y in range(first_row, height, step):
+                output[y * width:(y + 1) * width] = \
+                    indices[source:source + width]
+                source += width
+        return output
 
     def read_blocks(self):
-        byte1 = self.file.read(1)
-        while byte1 != b"" and byte1 != b";":
-            if byte1 == b"!":
-                byte2 = ord(self.file.read(1))
-                if byte2 == 0xff:
-                    chunk = self.file.read(12)[1:]
-                    if chunk == b"NETSCAPE2.0":
-                        self.file.seek(-12, SEEK_CUR)
-                        self.read_anim()
-                    else:
-                        chunk = self.file.read(10)
-                        self.file.seek(-10, SEEK_CUR)
-                elif byte2 == 0xfe:
+        while self.position < len(self.data):
+            introducer = self.read(1)
+            if introducer == b";":
+                return
+            if introducer == b"!":
+                label = self.read_int()
+                if label == 0xff and \
+                        self.data[self.position + 1:self.position + 12] == \
+                        b"NETSCAPE2.0":
+                    self.read_anim()
+                elif label == 0xfe:
                     self.comments.append(self.read_block_data())
-                elif byte2 == 0x01:
-                    self.read_block_data()
-                elif byte2 == 0xf9:
+                elif label == 0xf9:
                     self.read_gce()
                 else:
-                    return
-            elif byte1 == b",":
-                color_table = self.read_descriptor()
-                frame = self.read_pixels(color_table)
-                self.frames.append(frame)
+                    # application, plain text or unknown extension
+                    self.read_block_data()
+            elif introducer == b",":
+                self.frames.append(self.read_frame())
             else:
                 return
-            byte1 = self.file.read(1)
-    
+
     def read_file(self):
         self.read_header()
-        self.width = int.from_bytes(self.file.read(2), "little")
-        self.height = int.from_bytes(self.file.read(2), "little")
-        i = ord(self.file.read(1))
+        self.width = self.read_int(2)
+        self.height = self.read_int(2)
+        i = self.read_int()
         global_color_table_flag = i >> 7
         self.color_resolution = ((i >> 4) & 0b111) + 1
-        sort_flag = (i >> 3) & 1
         self.global_color_table_size = (i & 0b111) + 1
-        self.background_color_index = ord(self.file.read(1))
-        pixel_aspect_ratio = ord(self.file.read(1))
+        self.background_color_index = self.read_int()
+        pixel_aspect_ratio = self.read_int()
         if pixel_aspect_ratio != 0:
-            self.aspect_ratio = (pixel_aspect_ratio + 15) // 64
+            self.aspect_ratio = (pixel_aspect_ratio + 15) / 64
         else:
             self.aspect_ratio = 0
         if global_color_table_flag == 1:
             self.global_color_table = self.read_color_table()
         self.read_blocks()
-        self.file.close()
+
+    def rgb_rows(self, index=-1):
+        """Returns image as it looks after drawing frames up to index,
+rows of (red, green, blue) tuples, see GifFrame.rgb_rows
+
+        Image outside the first frame is filled with background color."""
+        frames = self.frames[:len(self.frames) + index + 1] \
+            if index < 0 else self.frames[:index + 1]
+        if not frames:
+            raise IndexError("Gif image has no frame {}".format(index))
+        color_table = self.global_color_table or frames[0].color_table
+        background = color_table[self.background_color_index]
+        pixels = [[background] * self.width for _ in range(self.height)]
+        for frame in frames:
+            transparent = frame.transparent_color_index
+            colors = frame.color_table
+            for y, row in enumerate(frame.index_rows(), frame.y):
+                if y >= self.height:
+                    break
+                line = pixels[y]
+                for x, color_index in enumerate(row, frame.x):
+                    if x >= self.width:
+                        break
+                    if color_index != transparent:
+                        line[x] = colors[color_index]
+        return pixels
+
+
+class SubBlockWriter:
+    """Writes data into a file as GIF sub-blocks, each sub-block written
+    as soon as its 255 bytes are ready"""
+
+    def __init__(self, image_file):
+        self.image_file = image_file
+        self.buffer = bytearray()
+
+    def write(self, data):
+        buffer = self.buffer
+        buffer += data
+        full_size = len(buffer) - len(buffer) % 255
+        if full_size:
+            self.image_file.write(b"".join(
+                b"\xff" + buffer[start:start + 255]
+                for start in range(0, full_size, 255)
+            ))
+            del buffer[:full_size]
+
+    def close(self):
+        """Writes remaining data and block terminator"""
+        if self.buffer:
+            self.image_file.write(bytes((len(self.buffer),)) + self.buffer)
+            self.buffer = bytearray()
+        self.image_file.write(b"\0")
 
 
 class GifBarcodeImage(BarcodeImage):
-    @classmethod
-    def _write_block_data(cls, image_file, data):
-        data_length = len(data)
-        prev_index = 0
-        index = min(255, data_length)
-        while prev_index < data_length:
-            image_file.write(
-                bytes((index - prev_index,)) + data[prev_index:index]
-            )
-            prev_index = index
-            index = min(index + 255, data_length)
-        image_file.write(b"\0")
+    # repeated rows are compressed in batches of about this many pixels
+    batch_size = 1 << 16
 
     def _write_header(self, image_file):
         self.bits_per_pixel = 2  # 1 bit would suffice, but gifs can't do that
@@ -273,31 +588,34 @@ class GifBarcodeImage(BarcodeImage):
         image_file.write(b"\0")     # no color table
         image_file.write(bytes([self.bits_per_pixel]))
 
+    def _write_pixels(self, image_file, bitmaps, scale=1):
+        """Compresses rows of bitmaps one at a time and writes them
+as image data
+
+        :param bitmaps:         Iterable of Bitmaps, one below the other
+        :param int scale:       Number of times every pixel and row
+                                is repeated"""
+        encoder = LzwEncoder(self.bits_per_pixel)
+        blocks = SubBlockWriter(image_file)
+        for bitmap in bitmaps:
+            for row, repeat in bitmap.unpacked_rows(scale):
+                batch_rows = max(1, self.batch_size // max(1, len(row)))
+                while repeat > 0:
+                    rows = min(repeat, batch_rows)
+                    blocks.write(encoder.encode(row * rows))
+                    repeat -= rows
+        blocks.write(encoder.finish())
+        blocks.close()
+
     def _write_bars(self, image_file):
-        linear_label = []
+        bitmaps = [self.render_barcode()]
         if self.text_areas is not None:
-            label = self.render_label()
-            linear_label = []
-            for line in label:
-                linear_label.extend(line)
-        data = []
-        for bit in self.data_bits:
-            data.extend(bit for _ in range(self.scale))
-        compressed = compress_gif(
-            tuple(data * self.barcode_height + linear_label),
-            self.bits_per_pixel
-        )
-        self._write_block_data(image_file, compressed)
-    
+            bitmaps.append(self.render_label())
+        self._write_pixels(image_file, bitmaps)
+
     def _write_squares(self, image_file):
-        data = []
-        for line in self.data_bits:
-            for _ in range(self.scale):
-                for bit in line:
-                    data.extend(bit for _ in range(self.scale))
-        compressed = compress_gif(tuple(data), self.bits_per_pixel)
-        self._write_block_data(image_file, compressed)
-    
+        self._write_pixels(image_file, [self.modules], self.scale)
+
     def _write_text_area(self, image_file):
         # TODO: write table here, not in write bars
         pass
@@ -6,26 +6,47 @@
 #
 from abc import ABC, abstractmethod
 
+from .bitmap import Bitmap
+
 
 class BarcodeImage(ABC):
     """Abstract class representing image of a 1D or 2D barcode
 
     Barcode can optionally contain a label, usually containing
     the same information as the barcode.
+
+    Modules of barcode are given as Bitmap or as bits, a sequence
+    of bits for linear barcode and sequence of rows of bits for 2D barcode.
+    Modules of linear barcode can be given as bar_widths instead, widths
+    of alternating white and black runs starting with white, see
+    BarcodeEncoding.widths.
+
+    Optional module_size is the intended physical width of a module
+    in millimetres. Formats able to store it record it as pixel density,
+    so the image prints at the right size with scale as low as 1.
     """
     file_open_mode = "wb"
 
-    def __init__(self, data_bits, barcode_height=None, label_height=0,
+    def __init__(self, data_bits=None, barcode_height=None, label_height=0,
                  scale=None, barcode_type="linear", text_areas=None,
-                 text_mask=None, font=None):
+                 text_mask=None, font=None, module_size=None,
+                 bar_widths=None):
         assert barcode_type in ("linear", "2D")
+        self.bar_widths = None
         if barcode_type == "linear":
-            self.data_bits = list(data_bits)
+            if bar_widths is not None:
+                self.bar_widths = tuple(bar_widths)
+                data_bits = Bitmap.from_widths(self.bar_widths)
+            elif not isinstance(data_bits, Bitmap):
+                data_bits = Bitmap.from_bits(data_bits)
+            self.modules = data_bits
             self.scale = scale or 2
             self.barcode_height = barcode_height
         else:
             # barcode_type == "2D"
-            self.data_bits = [list(line) for line in data_bits]
+            if not isinstance(data_bits, Bitmap):
+                data_bits = Bitmap.from_rows(data_bits)
+            self.modules = data_bits
             self.scale = scale or 8
             # height can't be chosen, its given by scale and content
             self.barcode_height = None
@@ -34,6 +55,18 @@ class BarcodeImage(ABC):
         self.text_areas = None
         self.text_mask = None
         self.font = None
+        if module_size is not None and module_size <= 0:
+            raise ValueError(
+                "Module size must be positive, got {!r}".format(module_size)
+            )
+        self.module_size = module_size
+
+    @property
+    def pixels_per_metre(self):
+        """Pixel density given by module_size, None if it's not set"""
+        if self.module_size is None:
+            return None
+        return round(1000 * self.scale / self.module_size)
 
     @property
     def image_height(self):
@@ -41,15 +74,12 @@ class BarcodeImage(ABC):
         if self.barcode_type == "linear":
             return self.barcode_height + self.label_height
         # self.barcode_type == "2D"
-        return len(self.data_bits) * self.scale  + self.label_height
+        return self.modules.height * self.scale + self.label_height
 
     @property
     def image_width(self):
         """Total image width in pixels"""
-        if self.barcode_type == "linear":
-            return len(self.data_bits) * self.scale
-        # self.barcode_type == "2D"
-        return len(self.data_bits[0]) * self.scale
+        return self.modules.width * self.scale
 
     def set_label(self, label_height, text_areas, text_mask, font):
         # TODO: sanity check
@@ -58,11 +88,16 @@ class BarcodeImage(ABC):
         self.text_mask = text_mask
         self.font = font
 
+    def render_barcode(self):
+        """Returns Bitmap of barcode scaled to image pixels"""
+        if self.barcode_type == "linear":
+            return self.modules.scaled(self.scale, self.barcode_height)
+        # self.barcode_type == "2D"
+        return self.modules.scaled(self.scale)
+
     def render_label(self):
-        label = [
-            [0] * (self.image_width)
-            for _ in range(self.label_height)
-        ]
+        """Returns Bitmap of label, each row stored separately"""
+        label = Bitmap(self.image_width, self.label_height)
         self.font.render_text_areas(
             self.text_areas,
             label,
@@ -72,13 +107,10 @@ class BarcodeImage(ABC):
         if self.text_mask is not None:
             y = 0
             for mask_line in self.text_mask:
-                mask_line_list = list(mask_line)
+                mask = Bitmap.from_bits(mask_line).scaled(self.scale)
                 for _ in range(self.scale):
-                    label_line = label[y]
+                    label.draw(0, y, mask.row_int(0), mask.width)
                     y += 1
-                    for i, bit in enumerate(mask_line_list):
-                        for j in range(self.scale):
-                            label_line[self.scale * i + j] |= bit
         return label
 
     @abstractmethod
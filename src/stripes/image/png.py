@@ -1,12 +1,387 @@
-from zlib import compress, crc32
+from zlib import (
+    adler32, compressobj, crc32, DEFLATED, DEF_MEM_LEVEL,
+    MAX_WBITS, Z_DEFAULT_COMPRESSION, Z_DEFAULT_STRATEGY,
+    Z_FINISH, Z_RLE, Z_SYNC_FLUSH
+)
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
 
+from .bitmap import Bitmap
 from .image import BarcodeImage
 
 
+NONE = 0
+SUB = 1
+UP = 2
+AVERAGE = 3
+PAETH = 4
+
+# absolute value of filtered byte taken as signed
+_signed_abs = bytes(value if value < 128 else 256 - value for value in range(256))
+
+
+def _subtract(x, y, size):
+    """Subtracts every byte of y from byte of x, modulo 256, both ints
+of size bytes"""
+    high = int.from_bytes(b"\x80" * size, "big")
+    return ((x | high) - (y & ~high)) ^ ((x ^ ~y) & high)
+
+
+def filter_row(filter_type, row, previous):
+    """Applies PNG filter to a scanline of 1 bit pixels, where every
+byte is compared to the byte before it
+
+    :param int filter_type:     NONE, SUB, UP, AVERAGE or PAETH
+    :param bytes row:           Scanline without filter type
+    :param bytes previous:      Previous scanline, zeroes for first one
+    :return:                    Filtered scanline without filter type"""
+    size = len(row)
+    if filter_type == NONE:
+        return bytes(row)
+    if filter_type == PAETH:
+        filtered = bytearray(size)
+        left = 0
+        upper_left = 0
+        for i, (raw, upper) in enumerate(zip(row, previous)):
+            estimate = left + upper - upper_left
+            left_distance = abs(estimate - left)
+            upper_distance = abs(estimate - upper)
+            upper_left_distance = abs(estimate - upper_left)
+            if left_distance <= upper_distance and \
+                    left_distance <= upper_left_distance:
+                predictor = left
+            elif upper_distance <= upper_left_distance:
+                predictor = upper
+            else:
+                predictor = upper_left
+            filtered[i] = (raw - predictor) & 255
+            left = raw
+            upper_left = upper
+        return bytes(filtered)
+    # remaining filters subtract predictor from all bytes at once
+    raw = int.from_bytes(row, "big")
+    if filter_type == SUB:
+        predictor = raw >> 8
+    elif filter_type == UP:
+        predictor = int.from_bytes(previous, "big")
+    elif filter_type == AVERAGE:
+        left = raw >> 8
+        upper = int.from_bytes(previous, "big")
+        ones = int.from_bytes(b"\x01" * size, "big")
+        predictor = (left & upper) + (((left ^ upper) & ~ones) >> 1)
+    else:
+        raise ValueError("Unknown filter type {!r}".format(filter_type))
+    return _subtract(raw, predictor, size).to_bytes(size, "big")
+
+
+def minimum_sad_filter(row, previous):
+    """Picks filter minimizing sum of absolute values of filtered bytes
+
+    :return:                    tuple of (filter type, filtered scanline)"""
+    best = None
+    for filter_type in (NONE, SUB, UP, AVERAGE, PAETH):
+        filtered = filter_row(filter_type, row, previous)
+        score = sum(filtered.translate(_signed_abs))
+        if best is None or score < best[0]:
+            best = (score, filter_type, filtered)
+    return best[1:]
+
+
+filter_heuristics = ("none", "up", "minsad")
+
+
+def filtered_rows(bitmap, heuristic="up", previous=None,
+                  batch_size=1 << 16):
+    """Yields scanlines of 1 bit greyscale bitmap, 1 for white, each
+prefixed by its filter type
+
+    Filter heuristic is one of:
+        "none"      No filtering.
+        "up"        First scanline of every stored row is not filtered,
+                    its repetitions use Up filter, which turns them into
+                    zeroes.
+        "minsad"    First scanline of every stored row uses filter with
+                    minimal sum of absolute differences, repetitions
+                    use Up filter.
+
+    Repetitions are yielded in batches of at most about batch_size bytes,
+so that tall images don't need the whole image data in memory.
+
+    :param Bitmap bitmap:   Image rows
+    :param str heuristic:   Filter heuristic
+    :param bytes previous:  Scanline preceding the bitmap, if any
+    :param int batch_size:  Maximum size of repetition batch in bytes
+    :return:                Yields bytes-like parts of image data"""
+    if heuristic not in filter_heuristics:
+        raise ValueError("Unknown filter heuristic {!r}".format(heuristic))
+    if previous is None:
+        previous = bytes(bitmap.stride)
+    for row, repeat in bitmap.rows():
+        if heuristic == "minsad":
+            filter_type, filtered = minimum_sad_filter(row, previous)
+        else:
+            filter_type, filtered = (NONE, row)
+        yield bytes((filter_type,))
+        yield filtered
+        if heuristic == "none":
+            repeated_row = b"\x00" + row
+        else:
+            repeated_row = b"\x02" + bytes(bitmap.stride)
+        batch_rows = max(1, batch_size // len(repeated_row))
+        repeat -= 1
+        while repeat > 0:
+            rows = min(repeat, batch_rows)
+            yield repeated_row * rows
+            repeat -= rows
+        previous = row
+
+
+def last_row(bitmap):
+    """Returns last scanline of bitmap, None for empty bitmap"""
+    if not bitmap.repeats:
+        return None
+    return bytes(bitmap.row(len(bitmap.repeats) - 1))
+
+
+ADLER_BASE = 65521
+
+# deflate window, preceding data further back can't be referenced
+WINDOW_SIZE = 1 << 15
+
+
+def adler32_combine(first, second, second_length):
+    """Returns Adler-32 of concatenation of two byte strings
+
+    :param int first:           Adler-32 of the first string
+    :param int second:          Adler-32 of the second string
+    :param int second_length:   Length of the second string"""
+    first_sum = first & 0xffff
+    second_sum = second & 0xffff
+    total = (first_sum + second_sum - 1) % ADLER_BASE
+    sum_of_sums = (first >> 16) + (second >> 16) + \
+        second_length * (first_sum - 1)
+    return ((sum_of_sums % ADLER_BASE) << 16) | total
+
+
+def zlib_header(compress_level):
+    """Returns zlib stream header for deflate with 32 KiB window"""
+    if compress_level < 0:
+        compress_level = 6
+    method = 0x78
+    if compress_level < 2:
+        flags = 0 << 6
+    elif compress_level < 6:
+        flags = 1 << 6
+    elif compress_level == 6:
+        flags = 2 << 6
+    else:
+        flags = 3 << 6
+    flags |= -((method << 8) | flags) % 31
+    return bytes((method, flags))
+
+
+def compress_band(band, dictionary, last, compress_level, strategy):
+    """Compresses band of data into raw deflate blocks ending on byte
+boundary, the last band ends the deflate stream
+
+    :return:        tuple of (deflate blocks, Adler-32 of band)"""
+    compressor = compressobj(
+        compress_level,
+        DEFLATED,
+        -MAX_WBITS,
+        DEF_MEM_LEVEL,
+        strategy,
+        dictionary
+    )
+    compressed = compressor.compress(band)
+    compressed += compressor.flush(Z_FINISH if last else Z_SYNC_FLUSH)
+    return (compressed, adler32(band))
+
+
+class ParallelCompressor:
+    """zlib stream compressed in bands by a pool of threads, with the
+    compress and flush methods of zlib compressobj
+
+    Data is cut into bands of band_size bytes, each band is compressed
+    by its own compressor primed with the last 32 KiB of the band before
+    it and ended with a sync flush, so that compressed bands concatenate
+    into a single deflate stream. Checksum of the stream is combined
+    from checksums of the bands. zlib releases the GIL while compressing,
+    so the bands are compressed in parallel.
+    """
+
+    def __init__(self, compress_level=Z_DEFAULT_COMPRESSION,
+                 strategy=Z_DEFAULT_STRATEGY, workers=None,
+                 band_size=1 << 20):
+        """:param int compress_level:  zlib compression level
+        :param int strategy:        zlib strategy
+        :param int workers:         Number of threads, all CPUs if None
+        :param int band_size:       Size of band in bytes
+
+        Use as a context manager or call close, so that the thread pool
+        is shut down when compression fails before flush."""
+        self.compress_level = compress_level
+        self.strategy = strategy
+        if workers is None:
+            workers = cpu_count()
+        elif workers < 1:
+            raise ValueError(
+                "Number of workers must be at least 1, got {!r}".format(
+                    workers
+                )
+            )
+        self.workers = workers
+        if band_size < 1:
+            raise ValueError(
+                "Band size must be at least 1, got {!r}".format(band_size)
+            )
+        self.band_size = band_size
+        # thread pool is started when the first band is submitted and
+        # shut down by flush or close
+        self.executor = None
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.dictionary = b""
+        self.checksum = 1
+        self.started = False
+
+    def _submit(self, band, last):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.workers)
+        future = self.executor.submit(
+            compress_band,
+            band,
+            self.dictionary,
+            last,
+            self.compress_level,
+            self.strategy
+        )
+        self.pending.append((future, len(band)))
+        self.dictionary = band[-WINDOW_SIZE:]
+
+    def _collect(self, wait_all):
+        """Returns compressed bands finished so far, in order, waiting
+        for all bands if wait_all or for the oldest ones while too many
+        are in progress"""
+        output = []
+        if not self.started:
+            output.append(zlib_header(self.compress_level))
+            self.started = True
+        while self.pending:
+            future, length = self.pending[0]
+            must_wait = wait_all or len(self.pending) > 2 * self.workers
+            if not must_wait and not future.done():
+                break
+            compressed, band_checksum = future.result()
+            self.pending.popleft()
+            self.checksum = adler32_combine(
+                self.checksum,
+                band_checksum,
+                length
+            )
+            output.append(compressed)
+        return b"".join(output)
+
+    def compress(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.band_size:
+            band = bytes(self.buffer[:self.band_size])
+            del self.buffer[:self.band_size]
+            self._submit(band, False)
+        return self._collect(False)
+
+    def flush(self):
+        try:
+            self._submit(bytes(self.buffer), True)
+            self.buffer = bytearray()
+            compressed = self._collect(True)
+        finally:
+            self.close()
+        return compressed + self.checksum.to_bytes(4, "big")
+
+    def close(self):
+        """Cancels bands not compressed yet and shuts down the thread
+        pool"""
+        for future, _ in self.pending:
+            future.cancel()
+        self.pending.clear()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 class PngBarcodeImage(BarcodeImage):
     HEADER = b"\x89PNG\r\n\x1a\x0a"
 
+    # maximum size of IDAT chunk, image data is compressed and written
+    # in chunks of this size as rows are added
+    idat_chunk_size = 1 << 16
+
+    # compression settings trading speed against file size
+    presets = {
+        "default": {
+            "compress_level": Z_DEFAULT_COMPRESSION,
+            "strategy": Z_DEFAULT_STRATEGY,
+            "filter_heuristic": "up"
+        },
+        "speed": {
+            "compress_level": 1,
+            "strategy": Z_RLE,
+            "filter_heuristic": "up"
+        },
+        # one pass at the highest level, never larger than default but
+        # up to a tenth larger than the best setting for some barcodes,
+        # which would take compressing the image once per setting
+        "size": {
+            "compress_level": 9,
+            "strategy": Z_DEFAULT_STRATEGY,
+            "filter_heuristic": "up"
+        }
+    }
+
+    def __init__(self, *args, preset="default", compress_level=None,
+                 strategy=None, filter_heuristic=None, workers=1,
+                 band_size=1 << 20, **kwargs):
+        """Accepts arguments of BarcodeImage and compression settings
+
+        Preset "speed" compresses fastest, "size" compresses at the
+        highest level, which is slower than "default" and gives files
+        that are smaller or the same size. Both stream image data in a
+        single pass like "default".
+
+        :param str preset:          "default", "speed" or "size"
+        :param int compress_level:  zlib compression level, 0 - 9
+        :param int strategy:        zlib strategy, such as Z_RLE
+                                    or Z_FILTERED
+        :param str filter_heuristic:    "none", "up" or "minsad",
+                                        see filtered_rows
+        :param int workers:         Number of threads compressing image
+                                    data, all CPUs if None
+        :param int band_size:       Size of image data compressed by one
+                                    thread at once, see ParallelCompressor
+
+        Settings given explicitly override the preset."""
+        super().__init__(*args, **kwargs)
+        settings = self.presets.get(preset)
+        if settings is None:
+            raise ValueError("Unknown preset {!r}".format(preset))
+        self.compress_level = settings["compress_level"] \
+            if compress_level is None else compress_level
+        self.strategy = settings["strategy"] \
+            if strategy is None else strategy
+        self.filter_heuristic = settings["filter_heuristic"] \
+            if filter_heuristic is None else filter_heuristic
+        self.workers = workers
+        self.band_size = band_size
+
     class Chunk(ABC):
         def __init__(self, type_):
             self.type = type_
@@ -70,93 +445,91 @@ class PngBarcodeImage(BarcodeImage):
             for color in self.colors:
                 yield bytes(color)
     
-    class IdatChunk(Chunk):
-        def __init__(self):
-            super().__init__(b"IDAT")
-            self._payload = bytearray()
-
-        @classmethod
-        def encode_line(cls, bars, bar_width=1):
-            black_bar = 0
-            white_bar = (1 << bar_width) - 1
-            value = 0
-            length = 0
-            arr = bytearray()
-            for bar in bars:
-                value <<= bar_width
-                value |= black_bar if bar else white_bar
-                length += bar_width
-                if length >= 4096:
-                    length &= 4095
-                    out = value >> length
-                    value &= (1 << length) - 1
-                    arr.extend(out.to_bytes(512, "big"))
-            padding = -length % 8
-            if padding:
-                value <<= padding
-                length += padding
-            arr.extend(value.to_bytes(length // 8, "big"))
-            return arr
-
-        def add_line(self, filter_code, line, prev_line=None, bar_width=1):
-            self._payload.append(filter_code)
-            raw_line = self.encode_line(line, bar_width)
-            if filter_code == 0:
-                self._payload.extend(raw_line)
-            elif filter_code == 1:
-                next_it = iter(line)
-                self._payload.append(next(next_it))
-                self._payload.extend(
-                    (raw - prev) & 255
-                    for raw, prev in zip(next_it, raw_line)
-                )
-            elif filter_code == 2:
-                filtered_line = bytes(
-                    (raw - prev) & 255
-                    for raw, prev in zip(raw_line, prev_line)
+    class PhysChunk(Chunk):
+        UNKNOWN_UNIT = 0
+        METRE = 1
+
+        def __init__(self, pixels_per_unit_x, pixels_per_unit_y=None,
+                     unit=METRE):
+            super().__init__(b"pHYs")
+            self.pixels_per_unit_x = pixels_per_unit_x
+            self.pixels_per_unit_y = pixels_per_unit_y or pixels_per_unit_x
+            self.unit = unit
+
+        def payload(self):
+            yield self.encode_int(self.pixels_per_unit_x)
+            yield self.encode_int(self.pixels_per_unit_y)
+            yield self.encode_int(self.unit, 1)
+
+    class IdatStream:
+        """Compresses image data as it is added and writes it as IDAT
+        chunks of at most chunk_size bytes, so that only one chunk is held
+        in memory"""
+        TYPE = b"IDAT"
+
+        def __init__(self, image_file, chunk_size=1 << 16,
+                     compress_level=Z_DEFAULT_COMPRESSION,
+                     strategy=Z_DEFAULT_STRATEGY, filter_heuristic="up",
+                     workers=1, band_size=1 << 20):
+            self.image_file = image_file
+            self.chunk_size = chunk_size
+            if workers == 1:
+                self.compressor = compressobj(
+                    compress_level,
+                    DEFLATED,
+                    MAX_WBITS,
+                    DEF_MEM_LEVEL,
+                    strategy
                 )
-                self._payload.extend(filtered_line)
             else:
-                raise NotImplementedError()
-            return raw_line
-
-        def set_payload_from_barcode_line(
-            self, bars, bar_width, height, label=None
-        ):
-            lines = bytearray(1)
-            prev_line = self.encode_line(bars, bar_width)
-            lines.extend(prev_line)
-            rep_line = bytes((2,)) + bytes(len(prev_line))
-            lines.extend(rep_line * (height - 1))
-            if label is not None:
-                for line in label:
-                    filter_code = 0 if sum(line) < 0.1 * len(line) else 2
-                    lines.append(filter_code)
-                    if filter_code == 0:
-                        prev_line = self.encode_line(line)
-                        lines.extend(prev_line)
-                    elif filter_code == 2:
-                        raw_line = self.encode_line(line)
-                        filtered_line = bytes(
-                            (raw - prev) & 255
-                            for raw, prev in zip(raw_line, prev_line)
-                        )
-                        lines.extend(filtered_line)
-                        prev_line = raw_line
-            self._payload = lines
-
-        def set_payload_from_squares(self, squares, scale, label=None):
-            lines = bytearray()
-            for line in squares:
-                lines.append(0)
-                encoded_line = self.encode_line(line, scale)
-                lines.extend(encoded_line)
-                rep_line = bytes((2,)) + bytes(len(encoded_line))
-                lines.extend(rep_line * (scale - 1))
-            self._payload = lines
-        
-        def payload(self):
-            yield compress(self._payload)
+                self.compressor = ParallelCompressor(
+                    compress_level,
+                    strategy,
+                    workers,
+                    band_size
+                )
+            self.filter_heuristic = filter_heuristic
+            self.previous = None
+            self.buffer = bytearray()
+
+        def write(self, data):
+            """Compresses part of image data"""
+            self.buffer += self.compressor.compress(data)
+            while len(self.buffer) >= self.chunk_size:
+                self._write_chunk(self.buffer[:self.chunk_size])
+                del self.buffer[:self.chunk_size]
+
+        def add_bitmap(self, bitmap):
+            """Compresses rows of 1 bit greyscale bitmap, 1 for white"""
+            parts = filtered_rows(
+                bitmap,
+                self.filter_heuristic,
+                self.previous,
+                self.chunk_size
+            )
+            for part in parts:
+                self.write(part)
+            self.previous = last_row(bitmap) or self.previous
+
+        def close(self):
+            """Flushes compressor and writes the remaining chunks"""
+            self.buffer += self.compressor.flush()
+            for start in range(0, len(self.buffer), self.chunk_size):
+                self._write_chunk(self.buffer[start:start + self.chunk_size])
+            self.buffer = bytearray()
+
+        def shutdown(self):
+            """Shuts down threads of parallel compressor, if any"""
+            if isinstance(self.compressor, ParallelCompressor):
+                self.compressor.close()
+
+        def _write_chunk(self, data):
+            # crc covers chunk type followed by data
+            crc = crc32(data, crc32(self.TYPE))
+            self.image_file.write(len(data).to_bytes(4, "big"))
+            self.image_file.write(self.TYPE)
+            self.image_file.write(data)
+            self.image_file.write(crc.to_bytes(4, "big"))
 
     class IendChunk(Chunk):
         def __init__(self):
@@ -168,28 +541,35 @@ class PngBarcodeImage(BarcodeImage):
     @classmethod
     def save_barcode(cls, image_filename, bars, bar_width=None, height=None,
                      indexed=False, label=None):
-        bars = list(bars)
         bar_width = bar_width or 2
         height = height or 50
-        width = bar_width * len(bars)
+        bitmap = Bitmap.from_bits(bars).scaled(bar_width, height)
+        if label is not None:
+            bitmap.extend(Bitmap.from_rows(label))
         bit_depth = 1
         with open(image_filename, "wb") as out_file:
             out_file.write(cls.HEADER)
             out_file.write(
                 cls.IhdrChunk(
-                    width,
-                    height if label is None else height + len(label),
+                    bitmap.width,
+                    bitmap.height,
                     bit_depth,
                     cls.IhdrChunk.GREYSCALE
                 ).to_bytes()
             )
-            data_chunk = cls.IdatChunk()
-            data_chunk.set_payload_from_barcode_line(
-                bars, bar_width, height, label
-            )
-            out_file.write(data_chunk.to_bytes())
+            idat = cls.IdatStream(out_file, cls.idat_chunk_size)
+            idat.add_bitmap(bitmap.inverted())
+            idat.close()
             out_file.write(cls.IendChunk().to_bytes())
 
+    def write(self, image_file):
+        self.idat = None
+        try:
+            super().write(image_file)
+        finally:
+            if self.idat is not None:
+                self.idat.shutdown()
+
     def _write_header(self, image_file):
         image_file.write(self.HEADER)
         ihdr = self.IhdrChunk(
@@ -199,37 +579,29 @@ class PngBarcodeImage(BarcodeImage):
             self.IhdrChunk.GREYSCALE
         )
         image_file.write(ihdr.to_bytes())
+        if self.pixels_per_metre is not None:
+            image_file.write(self.PhysChunk(self.pixels_per_metre).to_bytes())
+        self.idat = self.IdatStream(
+            image_file,
+            self.idat_chunk_size,
+            self.compress_level,
+            self.strategy,
+            self.filter_heuristic,
+            self.workers,
+            self.band_size
+        )
     
     def _write_bars(self, image_file):
-        self.idat = self.IdatChunk()
-        self.idat.set_payload_from_barcode_line(
-            self.data_bits,
-            self.scale,
-            self.barcode_height
-        )
+        self.idat.add_bitmap(self.render_barcode().inverted())
 
     def _write_squares(self, image_file):
-        self.idat = self.IdatChunk()
-        self.idat.set_payload_from_squares(self.data_bits, self.scale)
+        self.idat.add_bitmap(self.render_barcode().inverted())
 
     def _write_text_area(self, image_file):
         if self.text_areas is None:
             return
-        label = self.render_label()
-        prev_line = None
-        line = None
-        for line in label:
-            filter_code = 0
-            if prev_line is not None and sum(line) < len(line) / 10:
-                filter_code = 2
-
-            prev_line = self.idat.add_line(
-                filter_code,
-                line,
-                prev_line,
-                bar_width=1
-            )
+        self.idat.add_bitmap(self.render_label().inverted())
 
     def _write_finish(self, image_file):
-        image_file.write(self.idat.to_bytes())
+        self.idat.close()
         image_file.write(self.IendChunk().to_bytes())
@@ -1,174 +1,174 @@
+from gzip import GzipFile
+from io import StringIO, TextIOWrapper
+from xml.sax.saxutils import escape
+
 from .image import BarcodeImage
 
 
+def _number(value):
+    """Formats coordinate, without decimal point if it's whole"""
+    if value == int(value):
+        return str(int(value))
+    return str(round(value, 4))
+
+
+def path_data(bitmap, row_height=1):
+    """Returns svg path data drawing black pixels of bitmap
+
+    Runs of black pixels are merged with runs of the same position
+and length on rows below into rectangles, so every stored row
+repetition, as well as every vertical bar spanning several rows,
+is a single rectangle.
+
+    :param Bitmap bitmap:       Pixels to draw
+    :param row_height:          Height of a row in path units
+    :return:                    str of path data, one closed subpath
+                                for each rectangle"""
+    parts = []
+    # (x, length) of run to y where its rectangle started
+    open_runs = {}
+    y = 0
+    for index, repeat in enumerate(bitmap.repeats):
+        runs = set(bitmap.runs(index))
+        for run in open_runs.keys() - runs:
+            parts.append((open_runs.pop(run), run, y))
+        for run in runs - open_runs.keys():
+            open_runs[run] = y
+        y += repeat
+    for run, start in open_runs.items():
+        parts.append((start, run, y))
+    parts.sort()
+    return "".join(
+        "M{} {}h{}v{}h-{}z".format(
+            x,
+            _number(start * row_height),
+            length,
+            _number((end - start) * row_height),
+            length
+        )
+        for start, (x, length), end in parts
+    )
+
+
+def bars_path_data(widths, height):
+    """Returns svg path data drawing bars given by their widths
+
+    :param widths:              Widths of alternating white and black
+                                runs, starting with white
+    :param height:              Height of bars in path units
+    :return:                    str of path data, one closed subpath
+                                for each bar"""
+    height = _number(height)
+    parts = []
+    x = 0
+    for index, width in enumerate(widths):
+        if index & 1 and width:
+            parts.append(
+                "M{} 0h{}v{}h-{}z".format(x, width, height, width)
+            )
+        x += width
+    return "".join(parts)
+
+
 class SvgBarcodeImage(BarcodeImage):
+    """Class for saving barcode image as .svg file
+
+    Coordinates are given in modules, viewBox scales them to pixels,
+    and all modules are drawn by a single path element.
+    """
     file_open_mode = "w"
 
-    """Class for saving barcode image as .svg file"""
-    SVG_OPEN = '<svg xmlns="http://www.w3.org/2000/svg"\n'\
-        '    version="1.1" xmlns:xlink="http://www.w3.org/1999/xlink"\n'\
-        '    width="{width}" height="{height}">\n'
+    SVG_OPEN = '<svg xmlns="http://www.w3.org/2000/svg" version="1.1"'\
+        ' width="{width}" height="{height}"'\
+        ' viewBox="0 0 {view_width} {view_height}">\n'
     SVG_CLOSE = "</svg>\n"
-    RECTANGLE = '    <rect x="{x}" y="{y}" width="{width}"'\
-                ' height="{height}" fill="{fill}" />\n'
-    TEXT = '    <text x="{x}" y="{y}" width="{width}"'\
-           ' height="{height}" font-size="{font_size}"'\
-           ' font-family="monospace" color="#000">{text}</text>\n'
-    
+    BACKGROUND = '<rect width="100%" height="100%" fill="#fff"/>\n'
+    PATH = '<path fill="#000" shape-rendering="crispEdges" d="{d}"/>\n'
+    TEXT = '<text x="{x}" y="{y}" font-size="{font_size}"'\
+           ' font-family="monospace" fill="#000">{text}</text>\n'
+
+    def __init__(self, *args, compress=False, **kwargs):
+        """Accepts arguments of BarcodeImage
+
+        :param bool compress:       Write gzip compressed .svgz,
+                                    file must be opened in binary mode"""
+        super().__init__(*args, **kwargs)
+        self.compress = compress
+        if compress:
+            self.file_open_mode = "wb"
+
     def _write_header(self, image_file):
         image_file.write(
             self.SVG_OPEN.format(
-                width=self.image_width,
-                height=self.image_height
-            )
-        )
-        image_file.write(
-            self.RECTANGLE.format(
-                x=0,
-                y=0,
                 width=self.image_width,
                 height=self.image_height,
-                fill="#fff"
+                view_width=self.modules.width,
+                view_height=_number(self.image_height / self.scale)
             )
         )
+        image_file.write(self.BACKGROUND)
 
     def _write_squares(self, image_file):
-        # TODO: better square merging, maybe polygon painting
-        bits = [[bit for bit in line] for line in self.data_bits]
-        size = len(bits)
-        for y in range(size):
-            x = 0
-            while x < size:
-                if bits[y][x] == 0:
-                    x = x + 1
-                    continue
-                next_x = x + 1
-                while next_x < size and bits[y][next_x]:
-                    bits[y][next_x] = 0
-                    next_x += 1
-                width = next_x - x
-                height = 1
-                while y + height < size and \
-                    all(bits[y + height][t] for t in range(x, next_x)):
-                    for t in range(x, next_x):
-                        bits[y + height][t] = 0
-                    height += 1
-                image_file.write(
-                    self.RECTANGLE.format(
-                        x=x * self.scale,
-                        y=y * self.scale,
-                        width=width * self.scale,
-                        height=height * self.scale,
-                        fill="#000"
-                    )
-                )
-                x = next_x
+        image_file.write(self.PATH.format(d=path_data(self.modules)))
+
+    def _write_bars(self, image_file):
+        height = self.barcode_height / self.scale
+        if self.bar_widths is not None:
+            d = bars_path_data(self.bar_widths, height)
+        else:
+            d = path_data(self.modules, height)
+        image_file.write(self.PATH.format(d=d))
 
     def _write_text_area(self, image_file):
         # TODO: fix vertical alignment
+        scale = self.scale
         for text_area in self.text_areas:
-            x = text_area["x_start"] * self.scale
-            y = self.barcode_height + \
-                (text_area["y_start"] + self.font.height) * self.scale
-            width = text_area["x_end"] * self.scale - x
-            if text_area.get("y_end") is None:
-                height = self.label_height - y
-            elif text_area["y_end"] >= 0:
-                height = text_area["y_end"] * self.scale - y
-            else:
-                # text_area["y_end"] < 0
-                y_end = self.image_height + text_area["y_end"] * self.scale
-                height = y_end - y
+            y = self.barcode_height / scale + \
+                text_area["y_start"] + self.font.height
             image_file.write(
                 self.TEXT.format(
-                    x=x,
-                    y=y,
-                    width=width,
-                    height=height,
-                    font_size=self.font.height * self.scale,
-                    text=text_area["text"]
-                )
-            )
-   
-    def _write_bars(self, image_file):
-        start = None
-        prev = None
-        for i, bit in enumerate(self.data_bits):
-            if prev == 0 and bit == 1:
-                start = i
-            elif prev == 1 and bit == 0:
-                image_file.write(
-                    self.RECTANGLE.format(
-                        x=start * self.scale,
-                        y=0,
-                        width=(i - start) * self.scale,
-                        height=self.barcode_height,
-                        fill="#000"
-                    )
-                )
-                start = None
-            prev = bit
-        if start is not None:
-            # if the barcode ends with black bar (which it typically wont)
-            image_file.write(
-                self.RECTANGLE.format(
-                    x=i * start,
-                    y=0,
-                    width=(i - start) * self.scale,
-                    height=self.barcode_height,
-                    fill="#000"
+                    x=text_area["x_start"],
+                    y=_number(y),
+                    font_size=self.font.height,
+                    text=escape(text_area["text"])
                 )
             )
 
-
     def _write_finish(self, image_file):
-        image_file.write(self.SVG_CLOSE)        
+        image_file.write(self.SVG_CLOSE)
+
+    def write(self, image_file):
+        if not self.compress:
+            super().write(image_file)
+            return
+        with GzipFile(fileobj=image_file, mode="wb", mtime=0) as gzip_file:
+            text_file = TextIOWrapper(gzip_file, encoding="utf-8")
+            super().write(text_file)
+            text_file.flush()
+            text_file.detach()
 
     @classmethod
-    def data(cls, bars, bar_width, height):
+    def data(cls, bars, bar_width, height, bar_widths=None):
         """
 
         :param bars:                Iterable of bits, 1 for black bar, 0 for
                                     background white color
         :param bar_width:           Width of thinnest bar, in pixels
         :param height:              Height of image, in pixels
+        :param bar_widths:          Widths of alternating spaces and bars
+                                    used instead of bars, see
+                                    BarcodeEncoding.widths
         :return:                    svg image data
         """
-        bars = list(bars)
-        width = len(bars) * bar_width
-        out = [
-            # svg header
-            cls.SVG_OPEN.format(width=width, height=height),
-            # white background
-            cls.RECTANGLE.format(x=0, width=width, height=height, fill="#fff")
-        ]
-        widths = []
-        prev = None
-
-        # Take an iterator of 0 and 1, save offset and length
-        # of each run of 1 to generate black rectangles later
-        for i, bit in enumerate(bars):
-            if prev == 0 and bit == 1:
-                start = i
-            elif prev == 1 and bit == 0:
-                widths.append((start, i - start))
-            prev = bit
-
-        for x, width in widths:
-            x *= bar_width
-            width *= bar_width
-            out.append(
-                cls.RECTANGLE.format(
-                    x=x,
-                    y=0,
-                    width=width,
-                    height=height,
-                    fill="#000"
-                )
-            )
-
-        out.append(cls.SVG_CLOSE)
-        return b"".join(bytes(line, "ascii") for line in out)
+        image = cls(
+            data_bits=bars,
+            barcode_height=height,
+            scale=bar_width,
+            bar_widths=bar_widths
+        )
+        out = StringIO()
+        image.write(out)
+        return out.getvalue().encode("ascii")
 
     @classmethod
     def save_barcode(cls, image_filename, bars, bar_width=None, height=None,
@@ -39,6 +39,9 @@ def modulo_gfn(a, mod, n):
     
 
 class GaloisField:
+    # fields shared by get, keyed by (primitive_poly, characteristic)
+    _fields = {}
+
     def __init__(self, primitive_poly=285, characteristic=2):
         self.primitive_poly = primitive_poly
         self.characteristic = characteristic
@@ -59,6 +62,22 @@ class GaloisField:
             self.log_table[e] = i
         self.log_table[0] = None
 
+    @classmethod
+    def get(cls, primitive_poly=285, characteristic=2):
+        """Returns shared field instance, building its tables on first use.
+Fields hold no state beside the tables, so one instance can serve
+every encoder using the same primitive polynomial.
+
+        :param int primitive_poly:  Primitive polynomial of the field
+        :param int characteristic:  Field characteristic
+        :return:                    GaloisField instance"""
+        key = (primitive_poly, characteristic)
+        field = cls._fields.get(key)
+        if field is None:
+            field = cls(primitive_poly, characteristic)
+            cls._fields[key] = field
+        return field
+
     def mul(self, a, b):
         if a == 0 or b == 0:
             return 0
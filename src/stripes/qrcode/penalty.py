@@ -0,0 +1,151 @@
+"""Mask penalty evaluation of QR code symbols (ISO/IEC 18004, 7.8.3)
+
+Symbols are evaluated in packed form: all rows of the symbol concatenated
+into a single int, first row in the most significant bits. Every row is
+preceded by four light separator bits and the last row is also followed
+by them. Separators stand in for the light quiet zone around the symbol
+and keep runs and patterns from spanning two rows, so each rule is
+evaluated for the whole symbol by a handful of shifts and ands.
+
+Packing is linear over xor, so symbol differing only by mask can be
+scored from one packed base and one packed mask plane per mask.
+"""
+
+N1 = 3
+N2 = 3
+N3 = 40
+N4 = 10
+
+SEPARATOR_WIDTH = 4
+
+_layouts = {}
+
+
+def popcount(n):
+    return bin(n).count("1")
+
+
+def pack(rows, width):
+    """Packs rows of symbol into a single int with light separators
+
+    :param rows:            Sequence of row ints, leftmost module being
+                            the most significant bit
+    :param int width:       Number of modules in a row
+    :return:                Packed int"""
+    row_format = "0{}b".format(width + SEPARATOR_WIDTH)
+    packed = int("".join(format(row, row_format) for row in rows), 2)
+    return packed << SEPARATOR_WIDTH
+
+
+def transpose(rows, width):
+    """Returns columns of symbol as row ints, first column first
+
+    :param rows:            Sequence of row ints, leftmost module being
+                            the most significant bit
+    :param int width:       Number of modules in a row
+    :return:                list of column ints, topmost module being
+                            the most significant bit"""
+    row_format = "0{}b".format(width)
+    row_strings = [format(row, row_format) for row in rows]
+    return [int("".join(column), 2) for column in zip(*row_strings)]
+
+
+def pack_both(rows, width):
+    """Returns packed rows and packed columns of a symbol"""
+    return (pack(rows, width), pack(transpose(rows, width), width))
+
+
+def layout(width):
+    """Returns masks of module bits of packed symbol of given width
+
+    :param int width:       Number of modules in a row
+    :return:                tuple of (horizontal pairs, vertical pairs),
+                            each bit set where both it and its right/lower
+                            neighbour are modules of the symbol"""
+    masks = _layouts.get(width)
+    if masks is None:
+        modules = pack([(1 << width) - 1] * width, width)
+        stride = width + SEPARATOR_WIDTH
+        masks = (modules & (modules >> 1), modules & (modules >> stride))
+        _layouts[width] = masks
+    return masks
+
+
+def run_penalty(packed, horizontal_pairs):
+    """Rule 1: runs of five or more same coloured modules in a line
+score N1 plus one point for each module above five.
+
+A run of length L has L - 4 windows of five modules and one start,
+so its score L - 2 is the number of windows plus two per start."""
+    same = ~(packed ^ (packed >> 1)) & horizontal_pairs
+    windows = same & (same >> 1) & (same >> 2) & (same >> 3)
+    starts = windows & ~(same << 1)
+    return popcount(windows) + (N1 - 1) * popcount(starts)
+
+
+def block_penalty(packed, horizontal_pairs, vertical_pairs, stride):
+    """Rule 2: N2 points for every 2x2 block of same coloured modules,
+overlapping blocks included"""
+    same = ~(packed ^ (packed >> 1)) & horizontal_pairs
+    same_vertical = ~(packed ^ (packed >> stride)) & vertical_pairs
+    blocks = same & (same >> stride) & same_vertical
+    return N2 * popcount(blocks)
+
+
+def finder_penalty(packed):
+    """Rule 3: N3 points for every 1:1:3:1:1 dark-light-dark-light-dark
+pattern preceded or followed by four light modules. Modules beyond
+the edge of the symbol are light."""
+    light = ~packed
+    core = packed & (light >> 1) & (packed >> 2) & (packed >> 3) & \
+        (packed >> 4) & (light >> 5) & (packed >> 6)
+    light4 = light & (light >> 1) & (light >> 2) & (light >> 3)
+    before = core & (light4 >> 7)
+    after = core & (light4 << 4)
+    return N3 * (popcount(before) + popcount(after))
+
+
+def balance_penalty(dark_modules, total_modules):
+    """Rule 4: N4 points for every full 5 % the proportion of dark modules
+deviates from 50 %"""
+    deviation = abs(20 * dark_modules - 10 * total_modules)
+    return N4 * (deviation // total_modules)
+
+
+def penalty_scores(packed, packed_columns, width):
+    """Evaluates each penalty rule for a packed symbol
+
+    :param int packed:          Rows of symbol packed by pack
+    :param int packed_columns:  Columns of symbol packed by pack
+    :param int width:           Number of modules in a row
+    :return:                    tuple of four rule scores"""
+    horizontal_pairs, vertical_pairs = layout(width)
+    stride = width + SEPARATOR_WIDTH
+    return (
+        run_penalty(packed, horizontal_pairs)
+        + run_penalty(packed_columns, horizontal_pairs),
+        block_penalty(packed, horizontal_pairs, vertical_pairs, stride),
+        finder_penalty(packed) + finder_penalty(packed_columns),
+        balance_penalty(popcount(packed), width ** 2)
+    )
+
+
+def penalty(packed, packed_columns, width):
+    """Returns total penalty score of a packed symbol, see penalty_scores"""
+    return sum(penalty_scores(packed, packed_columns, width))
+
+
+def row_penalty(packed, width):
+    """Cheap approximation of penalty evaluating rules 1 and 3 on rows
+only, plus the full rules 2 and 4, so the symbol doesn't have to be
+transposed
+
+    :param int packed:          Rows of symbol packed by pack
+    :param int width:           Number of modules in a row
+    :return:                    Approximate penalty score"""
+    horizontal_pairs, vertical_pairs = layout(width)
+    stride = width + SEPARATOR_WIDTH
+    return run_penalty(packed, horizontal_pairs) + \
+        block_penalty(packed, horizontal_pairs, vertical_pairs, stride) + \
+        finder_penalty(packed) + \
+        balance_penalty(popcount(packed), width ** 2)
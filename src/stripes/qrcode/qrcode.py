@@ -1,18 +1,21 @@
 # module state:
 # implemented:
 #       - QR codes version 1 through 40
-#       - selecting optimal encoding
+#       - splitting data into optimal numeric, alphanumeric and byte segments
 #       - byte, alphanumeric and numeric QR codes
 # not implemented:
 #       - kanji
 #       - ECI QR codes
 #       - splitting content of QR code into multiple QR codes
 
-from itertools import zip_longest, chain
+import re
+from array import array
+from datetime import timedelta
+from time import perf_counter
 
-from .reedsolomon import ReedSolomonEncoder
-from .bitarray import BitArray
+from .reedsolomon import encode_blocks
 from .galoisfield import modulo_gf2
+from .penalty import pack, pack_both, penalty, row_penalty
 
 
 capacities = (
@@ -26,7 +29,7 @@ capacities = (
     (4184, 3320, 2360, 1784), (4712, 3624, 2600, 2024), # 15, 16
     (5176, 4056, 2936, 2264), (5768, 4504, 3176, 2504), # 17, 18
     (6360, 5016, 3560, 2728), (6888, 5352, 3880, 3080), # 19, 20
-    (7456, 5172, 4096, 3248), (8048, 6256, 4544, 3536), # 21, 22
+    (7456, 5712, 4096, 3248), (8048, 6256, 4544, 3536), # 21, 22
     (8752, 6880, 4912, 3712), (9392, 7312, 5312, 4112), # 23, 24
     (10208, 8000, 5744, 4304), (10960, 8496, 6032, 4768),   # 25, 26
     (11744, 9024, 6464, 5024), (12248, 9544, 6968, 5288),   # 27, 28
@@ -164,7 +167,7 @@ mask_functions = [
     lambda row, col: (row // 2 ^ col // 3) & 1,
     lambda row, col: (row * col) % 6,
     lambda row, col: ((row * col) % 2 + (row * col) % 3) & 1,
-    lambda row, col: ((row + col) & 1 + (row * col) % 3) & 1
+    lambda row, col: ((row + col) % 2 + (row * col) % 3) & 1
 ]
 
 MARGIN_WIDTH = 4
@@ -175,6 +178,9 @@ FORMAT_WHITE = -2
 
 alphanumeric_special = " $%*+-./:"
 alphanumeric_symbols = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+alphanumeric_values = {
+    symbol: value for value, symbol in enumerate(alphanumeric_symbols)
+}
 
 encodings = {
     "numeric": 0b0001,
@@ -198,31 +204,38 @@ ec_level_index = {
     "H": 3
 }
 
+# character count indicator bit lengths for versions 1-9, 10-26 and 27-40
+length_bitlens = {
+    "numeric": (10, 12, 14),
+    "alphanumeric": (9, 11, 13),
+    "byte": (8, 16, 16),
+    "kanji": (8, 10, 12)
+}
 
-def select_encoding(s):
-    if s.isnumeric():
-        return "numeric"
-    if all(x in alphanumeric_symbols for x in s):
-        return "alphanumeric"
-    try:
-        s.encode("iso 8859-1")
-    except UnicodeEncodeError:
-        # Maybe test for unicode? 
-        pass
-    else:
-        return "byte"
-    # TODO: implement kanji detection and encoding
+# ranges of versions sharing character count indicator lengths
+version_ranges = ((1, 9), (10, 26), (27, 40))
+
+segment_encodings = ("numeric", "alphanumeric", "byte")
+
+digit_triples = re.compile("...", re.DOTALL)
+char_pairs = re.compile("..", re.DOTALL)
+
+# data bits of every group of three digits and every pair of alphanumeric
+# characters, so that a whole segment is encoded by a single join
+numeric_group_bits = {
+    "{:03d}".format(value): "{:010b}".format(value) for value in range(1000)
+}
+alphanumeric_pair_bits = {
+    first + second: "{:011b}".format(45 * i + j)
+    for i, first in enumerate(alphanumeric_symbols)
+    for j, second in enumerate(alphanumeric_symbols)
+}
 
 
 def encode_alnum_char(c):
-    o = ord(c)
-    if o >= 48 and o <= 57:
-        return o - 48
-    if o >= 65 and o <= 90:
-        return o - 55
     try:
-        return 36 + alphanumeric_special.index(c)
-    except ValueError:
+        return alphanumeric_values[c]
+    except KeyError:
         raise ValueError("Symbol is not in QRCode alphanumeric alphabet")
 
 
@@ -248,143 +261,216 @@ def encoding_length(encoding, data_length):
     return data_bitlength
 
 
-def encode(data, ec_level):
-    encoding = select_encoding(data)
-    length = len(data)
-    bits = BitArray()
-    bits.extend(encodings[encoding], 4)
-    enc_length = encoding_length(encoding, length)
-    version, capacity, length_len = version_info(enc_length, ec_level, encoding)
-    bits.extend(length, length_len)
-    if encoding == "numeric":
-        for i in range(0, length - 2, 3):
-            group = int(data[i:i + 3])
-            bits.extend(group, 10)
-        remainder = length % 3
-        if remainder == 1:
-            bits.extend(int(data[-1:]), 4)
-        elif remainder == 2:
-            bits.extend(int(data[-2:]), 7)
-    elif encoding == "alphanumeric":
-        even = length & 1 == 0
-        ln = length if even else length - 1
-        for i in range(0, ln, 2):
-            encoded = 45 * encode_alnum_char(data[i])
-            encoded += encode_alnum_char(data[i + 1])
-            bits.extend(encoded, 11)
-        if not even:
-            encoded = encode_alnum_char(data[length - 1])
-            bits.extend(encoded, 6)
-    elif encoding == "byte":
-        if isinstance(data, str):
-            data = data.encode("iso 8859-1")
-        for char in data:
-            bits.extend(char, 8)
-    elif encoding == "kanji":
-        raise ValueError("Kanji not supported yet")
-    else:
+def length_bitlen(encoding, version):
+    """Returns bit length of character count indicator"""
+    if version < 10:
+        return length_bitlens[encoding][0]
+    elif version < 27:
+        return length_bitlens[encoding][1]
+    return length_bitlens[encoding][2]
+
+
+def segment(data, version):
+    """Splits data into numeric, alphanumeric and byte segments so that
+the encoded bit stream is as short as possible.
+
+Dynamic programming over characters keeps the cheapest cost of ending
+each character in each encoding. Costs are counted in sixths of a bit,
+so numeric (10 bits per 3) and alphanumeric (11 bits per 2) characters
+cost whole units, and a segment is rounded up to whole bits when
+it is closed by a switch to another encoding.
+
+    :param str data:        Data to encode, characters of ISO 8859-1
+    :param int version:     Version determining character count
+                            indicator lengths
+    :return:                tuple of list of (encoding, chunk) pairs
+                            and total bit length of the segments"""
+    if isinstance(data, (bytes, bytearray)):
+        segments = [("byte", data)] if data else []
+        return (segments, segments_length(segments, version))
+    # numeric, alphanumeric and byte costs of one character
+    char_costs = (20, 33, 48)
+    heads = [6 * (4 + length_bitlen(enc, version)) for enc in segment_encodings]
+    costs = list(heads)
+    # for every character and encoding ending it, encoding the character
+    # itself was encoded in
+    sources = bytearray(3 * len(data))
+    for i, char in enumerate(data):
+        if ord(char) > 255:
+            raise ValueError(
+                "Character {!r} can't be encoded in QR code".format(char)
+            )
+        new_costs = [None, None, costs[2] + char_costs[2]]
+        sources[3 * i + 2] = 2
+        if char in alphanumeric_symbols:
+            new_costs[1] = costs[1] + char_costs[1]
+            sources[3 * i + 1] = 1
+            if "0" <= char <= "9":
+                new_costs[0] = costs[0] + char_costs[0]
+                sources[3 * i] = 0
+        # closing the cheapest segment and opening another one
+        closed = min(
+            (-(-cost // 6) * 6, source)
+            for source, cost in enumerate(new_costs)
+            if cost is not None
+        )
+        for target in range(3):
+            switched = closed[0] + heads[target]
+            if new_costs[target] is None or switched < new_costs[target]:
+                new_costs[target] = switched
+                sources[3 * i + target] = closed[1]
+        costs = new_costs
+    encoding_index = costs.index(min(costs))
+    chunk_end = len(data)
+    segments = []
+    for i in range(len(data) - 1, -1, -1):
+        source = sources[3 * i + encoding_index]
+        if source != encoding_index:
+            if chunk_end > i + 1:
+                segments.append(
+                    (segment_encodings[encoding_index], data[i + 1:chunk_end])
+                )
+            chunk_end = i + 1
+            encoding_index = source
+    if chunk_end > 0:
+        segments.append((segment_encodings[encoding_index], data[:chunk_end]))
+    segments.reverse()
+    return (segments, segments_length(segments, version))
+
+
+def segments_length(segments, version):
+    """Returns bit length of encoded segments including mode indicators
+and character count indicators"""
+    return sum(
+        4 + length_bitlen(encoding, version)
+        + encoding_length(encoding, len(chunk))
+        for encoding, chunk in segments
+    )
+
+
+def encode_numeric(chunk):
+    """Returns data bits of numeric segment as tuple of (int, bit length)"""
+    groups = digit_triples.findall(chunk)
+    bits = "".join(map(numeric_group_bits.__getitem__, groups))
+    remainder = chunk[3 * len(groups):]
+    if remainder:
+        bits += format(int(remainder), "04b" if len(remainder) == 1 else "07b")
+    return (int(bits or "0", 2), len(bits))
+
+
+def encode_alphanumeric(chunk):
+    """Returns data bits of alphanumeric segment as tuple of
+(int, bit length)"""
+    pairs = char_pairs.findall(chunk)
+    try:
+        bits = "".join(map(alphanumeric_pair_bits.__getitem__, pairs))
+    except KeyError:
+        raise ValueError("Symbol is not in QRCode alphanumeric alphabet")
+    if len(chunk) & 1:
+        bits += format(encode_alnum_char(chunk[-1]), "06b")
+    return (int(bits or "0", 2), len(bits))
+
+
+def encode_bytes(chunk):
+    """Returns data bits of byte segment as tuple of (int, bit length)"""
+    if isinstance(chunk, str):
+        chunk = chunk.encode("iso 8859-1")
+    return (int.from_bytes(chunk, "big"), 8 * len(chunk))
+
+
+segment_encoders = {
+    "numeric": encode_numeric,
+    "alphanumeric": encode_alphanumeric,
+    "byte": encode_bytes
+}
+
+
+def encode_segment(encoding, chunk, version):
+    """Encodes mode indicator, character count and data of a segment
+
+    :return:        tuple of (int, bit length)"""
+    encoder = segment_encoders.get(encoding)
+    if encoder is None:
+        if encoding == "kanji":
+            raise ValueError("Kanji not supported yet")
         raise ValueError("Unknown encoding {!r}".format(encoding))
-    zeroes = min((4, capacity - enc_length))
-    bits.extend(0, zeroes)
-    encoded = bits.to_bytes()
-    expected_length = capacities[version - 1][ec_level_index[ec_level]] // 8
-    pad_bytes = expected_length - len(encoded)
+    data_bits, data_bitlength = encoder(chunk)
+    count_bitlength = length_bitlen(encoding, version)
+    header = (encodings[encoding] << count_bitlength) | len(chunk)
+    bit_length = 4 + count_bitlength + data_bitlength
+    return ((header << data_bitlength) | data_bits, bit_length)
+
+
+def encode(data, ec_level):
+    version, capacity, segments = version_info(data, ec_level)
+    stream = 0
+    bit_length = 0
+    for encoding, chunk in segments:
+        segment_bits, segment_bitlength = encode_segment(
+            encoding,
+            chunk,
+            version
+        )
+        stream = (stream << segment_bitlength) | segment_bits
+        bit_length += segment_bitlength
+    # terminator, then zeroes up to byte boundary
+    zeroes = min((4, capacity - bit_length))
+    zeroes += -(bit_length + zeroes) % 8
+    stream <<= zeroes
+    bit_length += zeroes
+    pad_bytes = (capacity - bit_length) // 8
     if pad_bytes > 0:
-        encoded += bytes(17 if i & 1 else 236 for i in range(pad_bytes))
-    return (encoded, encoding, version)
+        padding = (b"\xec\x11" * (pad_bytes // 2 + 1))[:pad_bytes]
+        stream = (stream << (8 * pad_bytes)) | int.from_bytes(padding, "big")
+    encoded = stream.to_bytes(capacity // 8, "big")
+    return (encoded, segments, version)
+
 
+def version_info(data, ec_level):
+    """Selects the smallest version that fits data in its optimal
+segmentation
 
-def version_info(bit_length, ec_level, encoding):
+    :param str data:        Data to encode
+    :param str ec_level:    Error correction level, "L", "M", "Q" or "H"
+    :return:                tuple of (version, capacity in bits, segments)"""
     ec_index = ec_level_index[ec_level]
-    length_bitlen_v10 = {
-        "numeric": 10,
-        "alphanumeric": 9,
-        "byte": 8,
-        "kanji": 8
-    }
-    length_bitlen_v27 = {
-        "numeric": 12,
-        "alphanumeric": 11,
-        "byte": 16,
-        "kanji": 10
-    }
-    length_bitlen_v40 = {
-        "numeric": 14,
-        "alphanumeric": 13,
-        "byte": 16,
-        "kanji": 12
-    }
-    max_capacity = capacities[-1][ec_index] - length_bitlen_v40[encoding]
-    if max_capacity < bit_length:
-        raise ValueError("Data too long to be encoded to QR code")
-    version = 1
-    version_selected = False
-    while not version_selected:
-        version_capacity = capacities[version - 1][ec_index]
-        if version < 10:
-            length_bitlen = length_bitlen_v10[encoding]
-        elif version < 27:
-            length_bitlen = length_bitlen_v27[encoding]
-        else:
-            length_bitlen = length_bitlen_v40[encoding]
-        true_capacity = version_capacity - length_bitlen - 4
-        if true_capacity >= bit_length:
-            version_selected = True
-        else:
-            version += 1
-    capacity = capacities[version - 1][ec_index]
-    return (version, capacity, length_bitlen)
+    for first_version, last_version in version_ranges:
+        if capacities[last_version - 1][ec_index] < len(data) * 10 // 3:
+            # even all-numeric data can't fit any version of the range
+            continue
+        segments, bit_length = segment(data, first_version)
+        for version in range(first_version, last_version + 1):
+            capacity = capacities[version - 1][ec_index]
+            if capacity >= bit_length:
+                return (version, capacity, segments)
+    raise ValueError("Data too long to be encoded to QR code")
 
 
-def correction_encode(encoded_data, version, ec_level):
-    ec_index = ec_level_index[ec_level]
-    format_ = blocks[version - 1][ec_index]
-    groups = (len(format_) - 1) // 2
-    #encoded_len = len(encoded_data)
-    #expected_len = sum(format_[2*g+1] * format_[2*g+2] for g in range(groups))
-    ec_blocks = []
-    data_blocks = []
-    group_start_index = 0
-    ec_len = format_[0]
-    for group in range(groups):
-        ec_blocks.append([])
-        data_blocks.append([])
-        block_count = format_[2 * group + 1]
-        block_len = format_[2 * group + 2]
-        rse = ReedSolomonEncoder(block_len, block_len + ec_len)
-        for block_index in range(block_count):
-            i = group_start_index + block_index * block_len
-            i2 = group_start_index + (block_index + 1) * block_len
-            enc_block = encoded_data[i:i2]
-            ec_block = rse.encode_block(enc_block)
-            ec_blocks[group].append(ec_block)
-            data_blocks[group].append(enc_block)
-        group_start_index += block_count * block_len
-    return (data_blocks, ec_blocks)
-
-
-def groups_iterator(groups):
-    blocks = (block for group in groups for block in group)
-    for vals in zip_longest(*blocks):
-        for val in vals:
-            if val != None:
-                yield val
-
-
-def interleave_blocks(groups):
-    interleaved = bytes(groups_iterator(groups))
-    return interleaved
-
-
-def qr_bits(data, ec_level):
-    encoded_data, encoding, version = encode(data, ec_level)
-    data_groups, ec_groups = correction_encode(encoded_data, version, ec_level)
-    ec_data = interleave_blocks(data_groups) + interleave_blocks(ec_groups)
-    ec_bits = BitArray(ec_data)
-    return (ec_bits, version)
+def qr_codewords(data, ec_level):
+    """Encodes data, computes error correction and interleaves everything
+into final codeword sequence of the symbol.
 
+    :return:        tuple of (codewords bytearray, version, segments)"""
+    encoded_data, segments, version = encode(data, ec_level)
+    layout = QRTemplate.get(version).codeword_layout(ec_level)
+    codewords = bytearray(layout.length)
+    source = memoryview(encoded_data)
+    ec_blocks = encode_blocks(
+        encoded_data,
+        layout.block_lengths,
+        layout.ec_len
+    )
+    for item, ec_block in zip(layout.blocks, ec_blocks):
+        start, block_len, data_slice, extra_index, ec_slice = item
+        block = source[start:start + block_len]
+        codewords[data_slice] = block[:layout.short_block_len]
+        if extra_index is not None:
+            codewords[extra_index] = block[-1]
+        codewords[ec_slice] = ec_block
+    return (codewords, version, segments)
 
-def format_string(ec_level, mask):
+
+def compute_format_string(ec_level, mask):
     ec_code = ec_level_code[ec_level]
     format_bits = (ec_code << 13) | (mask << 10)
     format_ec_bits = modulo_gf2(format_bits, 0b10100110111)
@@ -393,22 +479,80 @@ def format_string(ec_level, mask):
     return format_s
 
 
-def version_string(version):
+def compute_version_string(version):
     version_bits = version << 12
     version_ec_bits = modulo_gf2(version_bits, 0b1111100100101)
     version_s = version_bits | version_ec_bits
     return version_s
 
 
-class QRCode:
-    dimensionality = "2D"
+def format_string(ec_level, mask):
+    return QRTemplate.format_strings()[(ec_level, mask)]
 
-    def __init__(self, data, ec_level=None):
-        if ec_level == None:
-            ec_level = "Q"
-        self.ec_level = ec_level
-        self.bits, self.version = qr_bits(data, ec_level)
-        self.width = 17 + 4 * self.version
+
+def version_string(version):
+    return QRTemplate.version_strings()[version - 7]
+
+
+class CodewordLayout:
+    """Interleaving of data and error correction codewords of single
+version and error correction level.
+
+Codewords of each block are spread over the final sequence with a stride
+equal to the number of blocks, so every block is copied by a few extended
+slice assignments. Each item of blocks is a tuple of (start, length)
+of the block in encoded data, slice of its first short_block_len bytes
+in the sequence, index of its extra last byte (None for short blocks)
+and slice of its error correction bytes."""
+
+    def __init__(self, version, ec_level):
+        format_ = blocks[version - 1][ec_level_index[ec_level]]
+        self.ec_len = format_[0]
+        block_lengths = [
+            format_[2 * group + 2]
+            for group in range((len(format_) - 1) // 2)
+            for _ in range(format_[2 * group + 1])
+        ]
+        self.block_lengths = tuple(block_lengths)
+        block_count = len(block_lengths)
+        self.short_block_len = min(block_lengths)
+        self.data_length = sum(block_lengths)
+        self.length = self.data_length + block_count * self.ec_len
+        short_end = self.short_block_len * block_count
+        layout = []
+        start = 0
+        long_index = short_end
+        for index, block_len in enumerate(block_lengths):
+            if block_len > self.short_block_len:
+                extra_index = long_index
+                long_index += 1
+            else:
+                extra_index = None
+            layout.append((
+                start,
+                block_len,
+                slice(index, short_end, block_count),
+                extra_index,
+                slice(self.data_length + index, self.length, block_count)
+            ))
+            start += block_len
+        self.blocks = tuple(layout)
+
+
+class QRTemplate:
+    """Function patterns and reserved areas of single QR code version
+
+    Templates don't depend on encoded data, so they are built once per
+    version and shared by every symbol of that version. Use
+    QRTemplate.get to obtain one."""
+    _templates = {}
+    _format_strings = None
+    _version_strings = None
+
+    def __init__(self, version):
+        self.version = version
+        self.width = 17 + 4 * version
+        self.alignment_coordinates = self.compute_alignment_coordinates()
         self.matrix = [
             [DATA_WHITE for i in range(self.width)]
             for j in range(self.width)
@@ -419,10 +563,211 @@ class QRCode:
         self.mark_dark_module()
         self.reserve_format_information_area()
         self.reserve_version_information_area()
-        self.mark_bits()
-        self.mask_index = self.optimal_mask()
-        self.mark_format_string()
-        self.mark_version_information()
+        self.data_positions = self.compute_data_positions()
+        self.data_cell_map = self.compute_data_cell_map()
+        self.function_rows = self.compute_function_rows()
+        self.format_coordinates = self.compute_format_coordinates()
+        self.version_coordinates = self.compute_version_coordinates()
+        if version >= 7:
+            self.version_rows = self.coordinate_rows(
+                version_string(version),
+                self.version_coordinates
+            )
+        else:
+            self.version_rows = [0] * self.width
+        self._mask_planes = [None] * len(mask_functions)
+        self._mask_rows = {}
+        self._packed_masks = {}
+        self._codeword_layouts = {}
+
+    @classmethod
+    def get(cls, version):
+        """Returns shared template of given version, building it on first use
+
+        :param int version:     QR code version, 1 through 40
+        :return:                QRTemplate instance"""
+        template = cls._templates.get(version)
+        if template is None:
+            template = cls(version)
+            cls._templates[version] = template
+        return template
+
+    @classmethod
+    def format_strings(cls):
+        """Returns all 32 format strings keyed by (ec_level, mask)"""
+        if cls._format_strings is None:
+            cls._format_strings = {
+                (ec_level, mask): compute_format_string(ec_level, mask)
+                for ec_level in ec_level_code
+                for mask in range(8)
+            }
+        return cls._format_strings
+
+    @classmethod
+    def version_strings(cls):
+        """Returns tuple of all 34 version strings, for versions 7 to 40"""
+        if cls._version_strings is None:
+            cls._version_strings = tuple(
+                compute_version_string(version) for version in range(7, 41)
+            )
+        return cls._version_strings
+
+    def codeword_layout(self, ec_level):
+        """Returns CodewordLayout of this version and given level"""
+        layout = self._codeword_layouts.get(ec_level)
+        if layout is None:
+            layout = CodewordLayout(self.version, ec_level)
+            self._codeword_layouts[ec_level] = layout
+        return layout
+
+    def compute_alignment_coordinates(self):
+        if self.version == 1:
+            return ()
+        positions = alignments[self.version - 2]
+        # patterns overlapping finder patterns are left out
+        finder_corners = ((6, 6), (6, positions[-1]), (positions[-1], 6))
+        return tuple(
+            (x, y) for y in positions for x in positions
+            if (x, y) not in finder_corners
+        )
+
+    def is_data_module(self, x, y):
+        cell = self.matrix[y][x]
+        return cell != FORMAT_BLACK and cell != FORMAT_WHITE
+
+    def compute_data_positions(self):
+        """Walks the matrix in the zig-zag order in which data bits are
+placed, skipping function patterns.
+
+        :return:        array of flat indices (y * width + x) of data modules"""
+        positions = array("H")
+        width = self.width
+        i = width - 1
+        while i > 2:
+            for y in range(width - 1, -1, -1):
+                for x in (i, i - 1):
+                    if self.is_data_module(x, y):
+                        positions.append(y * width + x)
+            if i == 8:
+                # vertical timing pattern column is skipped entirely
+                i = 7
+            for y in range(width):
+                for x in (i - 2, i - 3):
+                    if self.is_data_module(x, y):
+                        positions.append(y * width + x)
+            i -= 4
+        return positions
+
+    def compute_data_cell_map(self):
+        """Inverse of data_positions: for every module, index of the data
+bit placed there. Function modules point one past the last data module.
+
+        :return:        array of bit indices in row-major module order"""
+        positions = self.data_positions
+        cell_map = array("H", (len(positions),)) * (self.width ** 2)
+        for bit_index, position in enumerate(positions):
+            cell_map[position] = bit_index
+        return cell_map
+
+    def compute_function_rows(self):
+        """Returns dark function pattern modules as one int per row,
+leftmost module being the most significant bit"""
+        return [
+            int("".join("1" if cell == FORMAT_BLACK else "0" for cell in row), 2)
+            for row in self.matrix
+        ]
+
+    def compute_format_coordinates(self):
+        """Returns (x, y) coordinates of both copies of each format bit,
+least significant bit first"""
+        width = self.width
+        coordinates = []
+        for i in range(6):
+            coordinates.append(((8, i), (width - 1 - i, 8)))
+        coordinates.append(((8, 7), (width - 7, 8)))
+        coordinates.append(((8, 8), (width - 8, 8)))
+        coordinates.append(((7, 8), (8, width - 7)))
+        for i in range(6):
+            coordinates.append(((5 - i, 8), (8, width - 6 + i)))
+        return tuple(coordinates)
+
+    def compute_version_coordinates(self):
+        """Returns (x, y) coordinates of both copies of each version bit,
+least significant bit first"""
+        if self.version < 7:
+            return ()
+        corner = self.width - 11
+        return tuple(
+            ((i // 3, corner + i % 3), (corner + i % 3, i // 3))
+            for i in range(18)
+        )
+
+    def mask_plane(self, index):
+        """Returns modules flipped by mask of given index as one int per row.
+
+Only data modules are included, so mask can be applied to data rows
+with a single xor per row.
+
+        :param int index:       Mask index, 0 through 7
+        :return:                list of row ints"""
+        plane = self._mask_planes[index]
+        if plane is None:
+            fn = mask_functions[index]
+            width = self.width
+            plane = [0] * width
+            for position in self.data_positions:
+                y, x = divmod(position, width)
+                if fn(y, x) == 0:
+                    plane[y] |= 1 << (width - 1 - x)
+            self._mask_planes[index] = plane
+        return plane
+
+    def coordinate_rows(self, number, coordinates):
+        """Returns row ints with modules set for each set bit of number
+
+        :param int number:          Bits to mark, least significant first
+        :param coordinates:         Sequence of module coordinates,
+                                    each item is tuple of (x, y) pairs
+        :return:                    list of row ints"""
+        rows = [0] * self.width
+        last_column = self.width - 1
+        for i, module_coordinates in enumerate(coordinates):
+            if (number >> i) & 1:
+                for x, y in module_coordinates:
+                    rows[y] |= 1 << (last_column - x)
+        return rows
+
+    def mask_rows(self, ec_level, index):
+        """Returns rows to xor with unmasked symbol to apply mask of given
+index, including the dark modules of matching format information
+
+        :param str ec_level:    Error correction level, "L", "M", "Q" or "H"
+        :param int index:       Mask index, 0 through 7
+        :return:                list of row ints"""
+        key = (ec_level, index)
+        rows = self._mask_rows.get(key)
+        if rows is None:
+            format_rows = self.coordinate_rows(
+                format_string(ec_level, index),
+                self.format_coordinates
+            )
+            rows = [
+                plane ^ format_row
+                for plane, format_row in zip(self.mask_plane(index), format_rows)
+            ]
+            self._mask_rows[key] = rows
+        return rows
+
+    def packed_mask(self, ec_level, index):
+        """Returns mask_rows packed for penalty evaluation
+
+        :return:        tuple of packed rows and packed columns"""
+        key = (ec_level, index)
+        packed = self._packed_masks.get(key)
+        if packed is None:
+            packed = pack_both(self.mask_rows(ec_level, index), self.width)
+            self._packed_masks[key] = packed
+        return packed
 
     def mark_rectangle(self, x, y, width, height, color_code):
         x2 = x + width
@@ -480,15 +825,8 @@ class QRCode:
         self.matrix[yindex + 2][xindex + 2] = FORMAT_BLACK
 
     def mark_alignment_patterns(self):
-        if self.version == 1:
-            return
-        positions = alignments[self.version - 2][1:]
-        for y in positions:
-            for x in positions:
-                self.mark_alignment_pattern(x, y)
-        for i in positions[:-1]:
-            self.mark_alignment_pattern(6, i)
-            self.mark_alignment_pattern(i, 6)
+        for x, y in self.alignment_coordinates:
+            self.mark_alignment_pattern(x, y)
 
     def mark_dark_module(self):
         self.matrix[-8][8] = FORMAT_BLACK
@@ -505,198 +843,195 @@ class QRCode:
             self.mark_rectangle(0, -11, 6, 3, FORMAT_WHITE)
             self.mark_rectangle(-11, 0, 3, 6, FORMAT_WHITE)
 
-    def data_position_generator(self):
-        i = self.width - 1
-        while i > 2:
-            x1 = i
-            x2 = i - 1
-            for y in range(self.width - 1, -1, -1):
-                x = x1
-                if self.matrix[y][x] != FORMAT_BLACK and \
-                   self.matrix[y][x] != FORMAT_WHITE:
-                    yield (x, y)
-                x = x2
-                if self.matrix[y][x] != FORMAT_BLACK and \
-                   self.matrix[y][x] != FORMAT_WHITE:
-                    yield (x, y)
-            if i == 8:
-                i = 7
-            x1 = i - 2
-            x2 = i - 3
-            for y in range(self.width):
-                x = x1
-                if self.matrix[y][x] != FORMAT_BLACK and \
-                   self.matrix[y][x] != FORMAT_WHITE:
-                    yield (x, y)
-                x = x2
-                if self.matrix[y][x] != FORMAT_BLACK and \
-                   self.matrix[y][x] != FORMAT_WHITE:
-                    yield (x, y)
-            i -= 4
+
+class QRCode:
+    """QR code symbol
+
+    Mask applied to the symbol is chosen by mask parameter:
+        "auto"      Evaluate all eight masks, pick the lowest penalty.
+        "fast"      Pick the lowest of approximate penalties, see
+                    penalty.row_penalty.
+        0 to 7      Use given mask without evaluating any.
+        timedelta   Evaluate masks until the time budget runs out
+                    and pick the best one evaluated so far.
+
+    Optional mask_cache is a dict shared between symbols. It maps
+version, error correction level, encodings and lengths of segments
+to the mask chosen for the first symbol of that shape, which is then
+reused without evaluation.
+    """
+    dimensionality = "2D"
+
+    def __init__(self, data, ec_level=None, mask="auto", mask_cache=None):
+        if ec_level == None:
+            ec_level = "Q"
+        self.ec_level = ec_level
+        self.codewords, self.version, self.segments = \
+            qr_codewords(data, ec_level)
+        self.template = QRTemplate.get(self.version)
+        self.width = self.template.width
+        self.mark_bits()
+        self.mask_index = self.select_mask(mask, mask_cache)
+        self.rows = self.mask(self.mask_index)
 
     def mark_bits(self):
-        for xy, bit in zip(self.data_position_generator(), self.bits):
-            x, y = xy
-            if bit:
-                self.matrix[y][x] = DATA_BLACK
-            else:
-                self.matrix[y][x] = DATA_WHITE
+        """Places bits of codewords into data_rows, one int per matrix row,
+and combines them with function patterns and version information
+into unmasked_rows"""
+        template = self.template
+        bit_count = 8 * len(self.codewords)
+        bits = format(
+            int.from_bytes(self.codewords, "big"),
+            "0{}b".format(bit_count)
+        )
+        # remainder bits and function modules all read the trailing zero
+        bits += "0" * (len(template.data_positions) + 1 - bit_count)
+        cells = "".join(map(bits.__getitem__, template.data_cell_map))
+        width = self.width
+        self.data_rows = [
+            int(cells[i:i + width], 2) for i in range(0, width ** 2, width)
+        ]
+        self.unmasked_rows = [
+            data | function | version
+            for data, function, version in zip(
+                self.data_rows,
+                template.function_rows,
+                template.version_rows
+            )
+        ]
 
-    def mark_format_string(self):
-        format_s = format_string(self.ec_level, self.mask_index)
-        for i in range(6):
-            bit = (format_s >> i) & 1
-            if bit:
-                self.matrix[i][8] = FORMAT_BLACK
-                self.matrix[8][-i - 1] = FORMAT_BLACK
-        if (format_s >> 6) & 1:
-            self.matrix[7][8] = FORMAT_BLACK
-            self.matrix[8][-7] = FORMAT_BLACK
-        if (format_s >> 7) & 1:
-            self.matrix[8][8] = FORMAT_BLACK
-            self.matrix[8][-8] = FORMAT_BLACK
-        if (format_s >> 8) & 1:
-            self.matrix[8][7] = FORMAT_BLACK
-            self.matrix[-7][8] = FORMAT_BLACK
-        for i in range(6):
-            bit = (format_s >> (i + 9)) & 1
-            if bit:
-                self.matrix[8][5 - i] = FORMAT_BLACK
-                self.matrix[i - 6][8] = FORMAT_BLACK
+    def mask(self, index):
+        """Returns rows of the finished symbol with mask of given index
+applied and matching format information marked"""
+        return [
+            row ^ mask
+            for row, mask in zip(
+                self.unmasked_rows,
+                self.template.mask_rows(self.ec_level, index)
+            )
+        ]
 
-    def mark_version_information(self):
-        if self.version >= 7:
-            base_x = 0
-            base_y = self.width - 11
-            version_s = version_string(self.version)
-            bit_index = 0
-            for x in range(base_x, base_x + 6):
-                for y in range(base_y, base_y + 3):
-                    bit = (version_s >> bit_index) & 1
-                    self.matrix[y][x] = bit
-                    bit_index += 1
-            base_x = self.width - 11
-            base_y = 0
-            bit_index = 0
-            for y in range(base_y, base_y + 6):
-                for x in range(base_x, base_x + 3):
-                    bit = (version_s >> bit_index) & 1
-                    self.matrix[y][x] = bit
-                    bit_index += 1
-
-    def mask(self, matrix, index):
-        fn = mask_functions[index]
-        for x, y in self.data_position_generator():
-            if fn(y, x) == 0:
-                if matrix[y][x] == DATA_WHITE:
-                    matrix[y][x] = DATA_BLACK
-                else:
-                    matrix[y][x] = DATA_WHITE
-
-    def optimal_mask(self):
-        best_matrix = None
-        best_penalty_score = 10 ** 9 # arbitrary big number
-        best_mask_index = None
+    def select_mask(self, strategy="auto", mask_cache=None):
+        """Returns index of mask chosen by strategy, see QRCode"""
+        if isinstance(strategy, int) and not isinstance(strategy, bool):
+            if not 0 <= strategy < len(mask_functions):
+                raise ValueError("Mask index must be 0 through 7")
+            return strategy
+        key = (
+            self.version,
+            self.ec_level,
+            tuple((encoding, len(chunk)) for encoding, chunk in self.segments)
+        )
+        if mask_cache is not None and key in mask_cache:
+            return mask_cache[key]
+        if strategy == "auto":
+            mask_index = self.optimal_mask()
+        elif strategy == "fast":
+            mask_index = self.fast_mask()
+        elif isinstance(strategy, timedelta):
+            mask_index = self.optimal_mask(strategy)
+        else:
+            raise ValueError("Unknown mask strategy {!r}".format(strategy))
+        if mask_cache is not None:
+            mask_cache[key] = mask_index
+        return mask_index
+
+    def optimal_mask(self, time_budget=None):
+        """Returns index of mask with the lowest penalty score
+
+        :param timedelta time_budget:   If given, stop evaluating masks
+                                        once the budget is spent
+        :return:                        Mask index"""
+        if time_budget is not None:
+            deadline = perf_counter() + time_budget.total_seconds()
+        width = self.width
+        # packing is linear over xor, so the unmasked symbol is packed
+        # once and combined with each packed mask
+        packed, packed_columns = pack_both(self.unmasked_rows, width)
+        scores = []
         for mask_index in range(8):
-            matrix_copy = [list(row) for row in self.matrix]
-            self.mask(matrix_copy, mask_index)
-            penalty_score = self.penalty(matrix_copy)
-            if penalty_score < best_penalty_score:
-                best_penalty_score = penalty_score
-                best_matrix = matrix_copy
-                best_mask_index = mask_index
-        self.matrix = best_matrix
-        return best_mask_index
-
-    def penalty(self, matrix):
-        penalty_score = 0
-        # condition one:
-        dark = 1
-        light = 0
-        col = lambda x: dark if x == DATA_BLACK or x == FORMAT_BLACK else light
-        colors = [[col(matrix[x][y]) for x in range(self.width)]
-                   for y in range(self.width)]
-        for row in colors:
-            last = None
-            consecutive = 0
-            for color in row:
-                if color == last:
-                    consecutive += 1
-                else:
-                    if consecutive > 4:
-                        penalty_score += consecutive - 2
-                    consecutive = 0
-                last = color
-        for x in range(self.width):
-            last = None
-            consecutive = 0
-            for y in range(self.width):
-                color = colors[y][x]
-                if color == last:
-                    consecutive += 1
-                else:
-                    if consecutive > 4:
-                        penalty_score += consecutive - 2
-                    consecutive = 0
-                last = col
-        # condition two:
-        for y in range(self.width - 1):
-            for x in range(self.width - 1):
-                if colors[y][x] == colors[y][x + 1] == \
-                   colors[y + 1][x] == colors[y + 1][x + 1]:
-                    penalty_score += 3
-        # condition three:
-        pattern = [dark, light, dark, dark, dark, light, dark]
-        four_white = lambda row, i: all(map(lambda x: x == light, row[i - 4:i]))
-        matches_pattern = lambda row, i: all(map(lambda z: z[0] == z[1],
-                                                 zip(row[i:], pattern)))
-        for row in colors:
-            for i in range(4, self.width - 7):
-                match = matches_pattern(row, i)
-                if match:
-                    if four_white(row, i):
-                        penalty_score += 40
-                    elif i + 11 < self.width and four_white(row, i + 7):
-                        penalty_score += 40
-        # condition four:
-        total = self.width ** 2
-        dark_modules = 0
-        for row in colors:
-            dark_modules += sum(map(lambda x: x == dark, row))
-        percentage = dark_modules // total
-        lower_limit = int(20 * percentage) - 10
-        upper_limit = lower_limit + 1
-        penalty_score += 10 * max(lower_limit, upper_limit)
-        return penalty_score
+            mask, mask_columns = self.template.packed_mask(
+                self.ec_level,
+                mask_index
+            )
+            scores.append(
+                penalty(packed ^ mask, packed_columns ^ mask_columns, width)
+            )
+            if time_budget is not None and perf_counter() >= deadline:
+                break
+        return scores.index(min(scores))
+
+    def fast_mask(self):
+        """Returns index of mask with the lowest approximate penalty score"""
+        width = self.width
+        packed = pack(self.unmasked_rows, width)
+        scores = [
+            row_penalty(
+                packed ^ self.template.packed_mask(self.ec_level, index)[0],
+                width
+            )
+            for index in range(8)
+        ]
+        return scores.index(min(scores))
+
+    def penalty(self, rows):
+        """Returns penalty score of symbol given as row ints"""
+        packed, packed_columns = pack_both(rows, self.width)
+        return penalty(packed, packed_columns, self.width)
+
+    def _image_rows(self):
+        margin = [0] * MARGIN_WIDTH
+        rows = [row << MARGIN_WIDTH for row in self.rows]
+        return (margin + rows + margin, self.width + 2 * MARGIN_WIDTH)
 
     def _image_bits(self):
-        # TODO: simplify
+        rows, width = self._image_rows()
+        row_format = "0{}b".format(width)
         return [
-            list(
-                chain(
-                    (DATA_WHITE for _ in range(MARGIN_WIDTH)),
-                    (int(bit == DATA_BLACK or bit == FORMAT_BLACK) for bit in line),
-                    (DATA_WHITE for _ in range(MARGIN_WIDTH))
-                )
-            )
-            for line in chain(
-                (
-                    (DATA_WHITE for _ in range(len(self.matrix)))
-                    for _ in range(MARGIN_WIDTH)
-                ),
-                self.matrix,
-                (
-                    (DATA_WHITE for _ in range(len(self.matrix)))
-                    for _ in range(MARGIN_WIDTH)
-                )
-            )
+            [int(module) for module in format(row, row_format)]
+            for row in rows
         ]
 
     @classmethod
-    def image_bits(self, data, ec_level=None):
-        qr = QRCode(data, ec_level)
+    def image_bits(self, data, ec_level=None, mask="auto", mask_cache=None):
+        qr = QRCode(data, ec_level, mask, mask_cache)
         return qr._image_bits()
 
+    @classmethod
+    def image_rows(cls, data, ec_level=None, mask="auto", mask_cache=None):
+        """Encodes data into rows of symbol surrounded by quiet zone
+
+        :return:        tuple of (list of row ints, leftmost module being
+                        the most significant bit, width in modules)"""
+        qr = QRCode(data, ec_level, mask, mask_cache)
+        return qr._image_rows()
+
+    @classmethod
+    def plan(cls, data, ec_level=None, scale=8):
+        """Computes version, segments and dimensions of symbol without
+error correction, placement or masking
+
+        :param str data:        Data to encode
+        :param str ec_level:    Error correction level, "L", "M", "Q" or "H"
+        :param int scale:       Module size in pixels
+        :return:                dict with version, ec_level, segments,
+                                modules of symbol side without quiet
+                                zone, quiet_zone, width and height"""
+        if ec_level == None:
+            ec_level = "Q"
+        version, capacity, segments = version_info(data, ec_level)
+        modules = 17 + 4 * version
+        size = (modules + 2 * MARGIN_WIDTH) * scale
+        return {
+            "version": version,
+            "ec_level": ec_level,
+            "segments": segments,
+            "modules": modules,
+            "quiet_zone": MARGIN_WIDTH,
+            "width": size,
+            "height": size
+        }
+
 
 def _unit_test():
     enc = encode("HELLO WORLD", "Q")
@@ -707,24 +1042,8 @@ def _unit_test():
     if not test1:
         print("enc[0]:", enc[0])
         print("expected1:", expected1)
-    group1 = [
-        [67,85,70,134,87,38,85,194,119,50,6,18,6,103,38],
-        [246,246,66,7,118,134,242,7,38,86,22,198,199,146,6]
-    ]
-    group2 = [
-        [182,230,247,119,50,7,118,134,87,38,82,6,134,151,50,7],
-        [70,247,118,86,194,6,151,50,16,236,17,236,17,236,17,236]
-    ]
-    groups = [group1, group2]
-    ec_group1 = [
-        [213,199,11,45,115,247,241,223,229,248,154,117,154,111,86,161,111,39],
-        [87,204,96,60,202,182,124,157,200,134,27,129,209,17,163,163,120,133]
-    ]
-    ec_group2 = [
-        [148,116,177,212,76,133,75,242,238,76,195,230,189,10,108,240,192,141],
-        [235,159,5,173,24,147,59,33,106,40,255,172,82,2,131,32,178,236]
-    ]
-    ec_groups = [ec_group1, ec_group2]
+    # data codewords of the blocks, encoded from a single byte segment
+    data = "There\\'s a frood who really knows where his towel is!"
     expected2 = [
         67, 246, 182, 70, 85, 246, 230, 247, 70, 66, 247, 118,
         134, 7, 119, 86, 87, 118, 50, 194, 38, 134, 7, 6, 85,
@@ -733,25 +1052,25 @@ def _unit_test():
         134, 17, 103, 146, 151, 236, 38, 6, 50, 17, 7, 236
     ]
     expected2 = bytes(expected2)
-    computed2 = interleave_blocks(groups)
-    test2 = computed2 == expected2
+    codewords, version, segments = qr_codewords(data, "Q")
+    layout = CodewordLayout(version, "Q")
+    computed2 = bytes(codewords[:layout.data_length])
+    test2 = version == 5 and computed2 == expected2
     print("test2 passed:", test2)
     if not test2:
+        print("version:", version)
         print("expected:", expected2)
-    final = [67, 246, 182, 70, 85, 246, 230, 247, 70, 66, 247, 118, 134, 7,
-             119, 86, 87, 118, 50, 194, 38, 134, 7, 6, 85, 242, 118, 151,
-             194, 7, 134, 50, 119, 38, 87, 16, 50, 86, 38, 236, 6, 22, 82,
-             17, 18, 198, 6, 236, 6, 199, 134, 17, 103, 146, 151, 236, 38,
-             6, 50, 17, 7, 236, 213, 87, 148, 235, 199, 204, 116, 159, 11,
-             96, 177, 5, 45, 60, 212, 173, 115, 202, 76, 24, 247, 182, 133,
-             147, 241, 124, 75, 59, 223, 157, 242, 33, 229, 200, 238, 106,
-             248, 134, 76, 40, 154, 27, 195, 255, 117, 129, 230, 172, 154,
-             209, 189, 82, 111, 17, 10, 2, 86, 163, 108, 131, 161, 163, 240,
-             32, 111, 120, 192, 178, 39, 133, 141, 236]
-    expected3 = interleave_blocks(ec_groups)
-    enc = bytes(group1[0] + group1[1] + group2[0] + group2[1])
-    corr = correction_encode(enc, 5, "Q")
-    computed3 = interleave_blocks(corr[1])
+        print("computed:", computed2)
+    expected3 = [
+        213, 87, 148, 235, 199, 204, 116, 159, 11, 96, 177, 5, 45, 60,
+        212, 173, 115, 202, 76, 24, 247, 182, 133, 147, 241, 124, 75, 59,
+        223, 157, 242, 33, 229, 200, 238, 106, 248, 134, 76, 40, 154, 27,
+        195, 255, 117, 129, 230, 172, 154, 209, 189, 82, 111, 17, 10, 2,
+        86, 163, 108, 131, 161, 163, 240, 32, 111, 120, 192, 178, 39, 133,
+        141, 236
+    ]
+    expected3 = bytes(expected3)
+    computed3 = bytes(codewords[layout.data_length:])
     test3 = computed3 == expected3
     print("test3 passed:", test3)
     if not test3:
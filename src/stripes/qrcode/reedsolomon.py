@@ -7,13 +7,18 @@ primitive_polynomials = [0, 0, 0, 11, 19, 37, 67, 131, 285, 1033]
 
 
 class ReedSolomonEncoder:
+    # generator polynomials and feedback tables keyed by
+    # (primitive_poly, degree)
+    _generators = {}
+    _feedback_tables = {}
+
     def __init__(self, k, n=None, primitive_poly=None):
         if n is None and primitive_poly is None:
             primitive_poly = 285
             n = 255
         elif primitive_poly is None:
             primitive_poly = 285
-        self.gf = GaloisField(primitive_poly)
+        self.gf = GaloisField.get(primitive_poly)
         if n is None:
             n = self.gf.element_count
         elif n > self.gf.element_count:
@@ -24,8 +29,56 @@ class ReedSolomonEncoder:
         self.n = n
         self.k = k
         self.corrections_len = n - k
-        self.gf = GaloisField(primitive_poly)
-        self.generator = self.compute_generator(self.corrections_len)
+        self.generator = self.cached_generator(self.corrections_len)
+
+    def cached_generator(self, degree):
+        """Returns generator polynomial of given degree, computing it only
+once per field and degree"""
+        key = (self.gf.primitive_poly, degree)
+        generator = self._generators.get(key)
+        if generator is None:
+            generator = self.compute_generator(degree)
+            self._generators[key] = generator
+        return generator
+
+    def feedback_table(self):
+        """Returns table of shift register feedback: for every byte f
+the product of f and generator polynomial without its leading term,
+packed into one big endian int. Computed once per field and degree.
+
+        :return:            tuple of 256 ints"""
+        key = (self.gf.primitive_poly, self.corrections_len)
+        table = self._feedback_tables.get(key)
+        if table is None:
+            if self.gf.element_count != 255:
+                raise ValueError("Feedback table requires 8 bit symbols")
+            coefficients = self.generator[1:]
+            table = tuple(
+                int.from_bytes(
+                    bytes(self.gf.mul(f, c) for c in coefficients),
+                    "big"
+                )
+                for f in range(256)
+            )
+            self._feedback_tables[key] = table
+        return table
+
+    def remainder(self, data):
+        """Computes error correction bytes of data by a table driven
+shift register, equivalent to gf.poly_mod(data, generator). The whole
+register is kept in a single int.
+
+        :param data:        bytes-like data, at most k bytes
+        :return:            bytes of error correction"""
+        table = self.feedback_table()
+        degree = self.corrections_len
+        shift = 8 * (degree - 1)
+        register_mask = (1 << (8 * degree)) - 1
+        register = 0
+        for byte in data:
+            register = ((register << 8) & register_mask) ^ \
+                table[(register >> shift) ^ byte]
+        return register.to_bytes(degree, "big")
 
     def compute_generator(self, degree=None):
         if degree is None:
@@ -132,6 +185,8 @@ class ReedSolomonEncoder:
             raise TypeError("Data should be bytes type")
         if len(data) != self.k:
             raise ValueError("Encoded data length is not one block")
+        if self.gf.element_count == 255:
+            return self.remainder(data)
         correction_data = self.gf.poly_mod(data, self.generator)
         return bytes(correction_data)
 
@@ -233,6 +288,26 @@ def encode_block(data, n=None):
     return encoded
 
 
+def encode_blocks(data, block_lengths, corrections_len, primitive_poly=285):
+    """Computes error correction of consecutive data blocks sharing
+the number of error correction bytes, as used by QR codes.
+
+    :param data:                    bytes-like data of all blocks
+    :param block_lengths:           Iterable of block lengths in bytes
+    :param int corrections_len:     Error correction bytes per block
+    :param int primitive_poly:      Primitive polynomial of GF(256)
+    :return:                        list of error correction bytes,
+                                    one item per block"""
+    rse = ReedSolomonEncoder(255 - corrections_len, 255, primitive_poly)
+    view = memoryview(data)
+    corrections = []
+    start = 0
+    for block_len in block_lengths:
+        corrections.append(rse.remainder(view[start:start + block_len]))
+        start += block_len
+    return corrections
+
+
 def decode_block(data, k, n=None):
     rse = ReedSolomonEncoder(k, n)
     decoded = rse.decode_block(data)
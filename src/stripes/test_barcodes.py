@@ -1,13 +1,37 @@
+from argparse import ArgumentTypeError
+from datetime import timedelta
+from io import BytesIO
+from random import Random
+from zlib import decompress
+
 from font import font5x7
 
-from image.png import PngBarcodeImage
-from image.svg import SvgBarcodeImage
+from image.bitmap import Bitmap
+from image.png import (
+    AVERAGE, PAETH, SUB, UP, ParallelCompressor, PngBarcodeImage, filter_row
+)
+from image.svg import SvgBarcodeImage, bars_path_data, path_data
 from image.bmp import BmpBarcodeImage
+from image.gif import (
+    GifBarcodeImage, GifImage, compress_gif, decompress_gif
+)
+
+from qrcode.galoisfield import GaloisField
+from qrcode.penalty import pack_both, penalty_scores
+from qrcode.qrcode import (
+    MARGIN_WIDTH, CodewordLayout, QRCode, capacities, ec_level_index, encode,
+    qr_codewords, segment, version_info
+)
+from qrcode.reedsolomon import ReedSolomonEncoder
+
+from encoding.code93 import Code93
+from encoding.code128 import Code128
+from encoding.ean import Ean
 
-from barcode import main as barcode_main
+from barcode import main as barcode_main, positive_float, positive_int
 
 
-def test_png_barcode():
+def test_png_barcode(tmp_path):
     bits = [0,0,0,0,1,0,1,0,1,0,1,0,0,0,0]
     bits.extend(0 for _ in range(40))
     img = PngBarcodeImage(data_bits=bits, label_height=30, barcode_height=20)
@@ -19,7 +43,7 @@ def test_png_barcode():
         "y_end": 12
     }]
     img.font = font5x7
-    with open("test_png_barcode_image.png", "wb") as file:
+    with open(str(tmp_path / "test_png_barcode_image.png"), "wb") as file:
         img.write(file)
     img2 = PngBarcodeImage(
         data_bits=[
@@ -31,14 +55,183 @@ def test_png_barcode():
         ],
         barcode_type="2D"
     )
-    with open("test_png_2d_image.png", "wb") as file:
+    with open(str(tmp_path / "test_png_2d_image.png"), "wb") as file:
         img2.write(file)
 
 
-def test_svg_image():
+def test_png_filters():
+    row = bytes((0x00, 0x0f, 0xff, 0x3c))
+    previous = bytes((0xf0, 0x0f, 0x00, 0x3c))
+    assert filter_row(SUB, row, previous) == bytes((0x00, 0x0f, 0xf0, 0x3d))
+    assert filter_row(UP, row, previous) == bytes((0x10, 0x00, 0xff, 0x00))
+    assert filter_row(AVERAGE, row, previous) == \
+        bytes((0x88, 0x08, 0xf8, 0x9f))
+    assert filter_row(PAETH, row, previous) == \
+        bytes((0x10, 0x0f, 0xff, 0x3d))
+    for preset in ("speed", "size"):
+        img = PngBarcodeImage(
+            data_bits=[[0, 1], [1, 0]],
+            barcode_type="2D",
+            preset=preset
+        )
+        img.write(BytesIO())
+
+
+def test_png_size_preset():
+    def image_size(**options):
+        out = BytesIO()
+        PngBarcodeImage(**options).write(out)
+        return len(out.getvalue())
+    for scale in (1, 4, 16):
+        for options in (
+                {"data_bits": QRCode.image_bits("HELLO WORLD", "M"),
+                 "barcode_type": "2D"},
+                {"data_bits": QRCode.image_bits("A" * 500, "M"),
+                 "barcode_type": "2D"},
+                {"data_bits": list(Code128.bars("hello World 123")),
+                 "barcode_height": 50}):
+            assert image_size(scale=scale, preset="size", **options) <= \
+                image_size(scale=scale, **options)
+
+
+def test_png_parallel():
+    def image_data(**options):
+        img = PngBarcodeImage(
+            data_bits=[[x * y % 3 == 0 for x in range(40)] for y in range(40)],
+            barcode_type="2D",
+            **options
+        )
+        out = BytesIO()
+        img.write(out)
+        png = out.getvalue()
+        # single IDAT chunk follows signature and IHDR
+        idat_length = int.from_bytes(png[33:37], "big")
+        assert png[37:41] == b"IDAT"
+        return decompress(png[41:41 + idat_length])
+    assert image_data(workers=3, band_size=100) == image_data()
+    for workers in (0, -1):
+        try:
+            ParallelCompressor(workers=workers)
+        except ValueError:
+            pass
+        else:
+            assert False, "ValueError not raised"
+        try:
+            positive_int(str(workers))
+        except ArgumentTypeError:
+            pass
+        else:
+            assert False, "ArgumentTypeError not raised"
+        try:
+            ParallelCompressor(workers=2, band_size=workers)
+        except ValueError:
+            pass
+        else:
+            assert False, "ValueError not raised"
+    with ParallelCompressor(workers=2, band_size=100) as compressor:
+        compressor.compress(bytes(1000))
+    assert compressor.executor is None
+
+    class FailingFile(BytesIO):
+        def write(self, data):
+            if data == b"IDAT":
+                raise OSError("Disk full")
+            return super().write(data)
+    img = PngBarcodeImage(
+        data_bits=[[x * y % 3 == 0 for x in range(40)] for y in range(40)],
+        barcode_type="2D",
+        workers=2,
+        band_size=100
+    )
+    # image data doesn't fit in one chunk, first one is written before
+    # compression ends
+    img.idat_chunk_size = 16
+    try:
+        img.write(FailingFile())
+    except OSError:
+        pass
+    else:
+        assert False, "OSError not raised"
+    assert img.idat.compressor.executor is None
+
+
+def test_png_idat_chunks():
+    random = Random(14)
+    size = 900
+    bits = [[random.randrange(2) for x in range(size)] for y in range(size)]
+    out = BytesIO()
+    PngBarcodeImage(data_bits=bits, barcode_type="2D", scale=1).write(out)
+    png = out.getvalue()
+    idat = []
+    position = 8
+    while position < len(png):
+        length = int.from_bytes(png[position:position + 4], "big")
+        if png[position + 4:position + 8] == b"IDAT":
+            assert length <= PngBarcodeImage.idat_chunk_size
+            idat.append(png[position + 8:position + 8 + length])
+        position += length + 12
+    # noise doesn't compress, so image data spans several chunks
+    assert len(idat) > 1
+    data = decompress(b"".join(idat))
+    stride = (size + 7) // 8
+    previous = bytes(stride)
+    for y in range(size):
+        start = y * (stride + 1)
+        filter_type = data[start]
+        row = data[start + 1:start + 1 + stride]
+        assert filter_type in (0, 2)
+        if filter_type == 2:
+            row = bytes((a + b) & 0xff for a, b in zip(row, previous))
+        # 1 for white in png
+        expected = int("".join(str(1 - bit) for bit in bits[y]), 2)
+        assert int.from_bytes(row, "big") >> (8 * stride - size) == expected
+        previous = row
+
+
+def test_physical_size(tmp_path):
+    bits = [[0, 1], [1, 0]]
+    png = BytesIO()
+    PngBarcodeImage(
+        data_bits=bits, barcode_type="2D", scale=1, module_size=0.5
+    ).write(png)
+    phys = png.getvalue().index(b"pHYs")
+    # 0.5 mm modules at 1 pixel per module
+    assert png.getvalue()[phys + 4:phys + 13] == \
+        (2000).to_bytes(4, "big") * 2 + b"\x01"
+    bmp = BytesIO()
+    BmpBarcodeImage(
+        data_bits=bits, barcode_type="2D", scale=4, module_size=0.5
+    ).write(bmp)
+    assert bmp.getvalue()[38:46] == (8000).to_bytes(4, "little") * 2
+    for module_size in (0, -0.5):
+        try:
+            PngBarcodeImage(
+                data_bits=bits, barcode_type="2D", module_size=module_size
+            )
+        except ValueError:
+            pass
+        else:
+            assert False, "ValueError not raised"
+        try:
+            positive_float(str(module_size))
+        except ArgumentTypeError:
+            pass
+        else:
+            assert False, "ArgumentTypeError not raised"
+    for file_type in ("png", "bmp", "svg", "svgz", "gif"):
+        out = str(tmp_path / "module_size.{}".format(file_type))
+        try:
+            barcode_main(["--module-size=0.5", "hello", out])
+        except ValueError:
+            assert file_type not in ("png", "bmp")
+        else:
+            assert file_type in ("png", "bmp")
+
+
+def test_svg_image(tmp_path):
     bits = [0,0,0,0,1,0,1,0,1,0,1,0,0,0,0]
     img = SvgBarcodeImage(data_bits=bits, barcode_height=20)
-    with open("test_svg_barcode_image.svg", "w") as file:
+    with open(str(tmp_path / "test_svg_barcode_image.svg"), "w") as file:
         img.write(file)
     img2 = SvgBarcodeImage(
         data_bits=[
@@ -50,14 +243,95 @@ def test_svg_image():
         ],
         barcode_type="2D"
     )
-    with open("test_svg_2d_image.svg", "w") as file:
+    with open(str(tmp_path / "test_svg_2d_image.svg"), "w") as file:
         img2.write(file)
+    # rows of the square are merged into one rectangle
+    assert path_data(img2.modules) == "M1 1h3v3h-3z"
+    assert path_data(img.modules, 10) == "M4 0h1v10h-1zM6 0h1v10h-1z" \
+        "M8 0h1v10h-1zM10 0h1v10h-1z"
+    svgz = BytesIO()
+    SvgBarcodeImage(data_bits=bits, barcode_height=20, compress=True).write(
+        svgz
+    )
+    svg = decompress(svgz.getvalue(), 31).decode("utf-8")
+    assert 'viewBox="0 0 15 10"' in svg
+
+
+def test_gif_lzw():
+    rows = bytes((x // 3 + y // 5) % 2 for y in range(200) for x in range(300))
+    # full dictionary kept and cleared later, codes up to 12 bits
+    compressed = compress_gif(rows, 2)
+    assert decompress_gif(compressed, 2) == rows
+    # noise fills the dictionary, which is cleared once noise returns
+    # after a blank part
+    noise = Random(3)
+    pixels = bytes(noise.randrange(4) for _ in range(30000)) + \
+        bytes(30000) + bytes(noise.randrange(4) for _ in range(30000))
+    compressed = compress_gif(pixels, 2)
+    assert decompress_gif(compressed, 2) == pixels
+
+    modules = [[noise.getrandbits(1) for _ in range(100)] for _ in range(100)]
+    img = GifBarcodeImage(data_bits=modules, barcode_type="2D", scale=3)
+    # compressed a few rows at a time, dictionary gets full on the way
+    img.batch_size = 1000
+    gif = BytesIO()
+    img.write(gif)
+    # header, color table, image descriptor and LZW code size
+    position = 30
+    sub_blocks = []
+    while gif.getvalue()[position]:
+        size = gif.getvalue()[position]
+        sub_blocks.append(gif.getvalue()[position + 1:position + 1 + size])
+        position += 1 + size
+    assert all(len(block) == 255 for block in sub_blocks[:-1])
+    assert decompress_gif(b"".join(sub_blocks), 2) == \
+        img.modules.unpacked(3)
+
+
+def test_gif_image(tmp_path):
+    img = GifBarcodeImage(data_bits=[1, 0, 1, 1, 0, 0], barcode_height=3)
+    path = str(tmp_path / "test_gif_barcode_image.gif")
+    with open(path, "wb") as file:
+        img.write(file)
+    gif = GifImage(path)
+    frame = gif.frames[0]
+    assert (gif.width, gif.height) == (12, 3)
+    assert bytes(frame.indices) == img.render_barcode().unpacked()
+    assert frame.bitmap().row_int(2) == 0b110011110000
+    assert gif.rgb_rows()[0][:3] == [(0, 0, 0), (0, 0, 0), (255, 255, 255)]
+    with open(path, "rb") as file:
+        data = file.read()
+    # cut inside first sub-block of image data and right after the last
+    # one, before block terminator and trailer
+    for end in (32, len(data) - 2):
+        with open(path, "wb") as file:
+            file.write(data[:end])
+        try:
+            GifImage(path)
+        except ValueError:
+            pass
+        else:
+            assert False, "ValueError not raised"
+
+
+def test_bitmap():
+    bitmap = Bitmap.from_rows([[1, 0, 1], [0, 1, 1]])
+    assert bytes(bitmap.memoryview()) == b"\xa0\x60"
+    scaled = bitmap.scaled(3)
+    assert (scaled.width, scaled.height) == (9, 6)
+    assert scaled.row_int(1) == 0b000111111
+    assert scaled.runs(0) == [(0, 3), (6, 3)]
+    assert bitmap.inverted().row_int(0) == 0b010
+    assert bitmap.unpacked() == b"\x01\x00\x01\x00\x01\x01"
+    assert Bitmap.from_bits([1, 0]).unpacked(2) == b"\x01\x01\x00\x00" * 2
+    bitmap.draw(1, 0, 1, 1)
+    assert bitmap.row_int(0) == 0b111
 
 
-def test_cmd():
+def test_cmd(tmp_path):
     contents = ("hello world", "WIKIPEDIA", "0123456789")
     barcode_types = ("code93", "code128", "qrcode")
-    file_types = ("png", "svg", "bmp", "gif")
+    file_types = ("png", "svg", "svgz", "bmp", "gif")
     for content in contents:
         for barcode_type in barcode_types:
             for file_type in file_types:
@@ -66,7 +340,9 @@ def test_cmd():
                     "--file-type={}".format(file_type),
                     # "--label={}".format(content),
                     content,
-                    "{}_{}.{}".format(content, barcode_type, file_type)
+                    str(tmp_path / "{}_{}.{}".format(
+                        content, barcode_type, file_type
+                    ))
                 ]
                 # TODO: implement labels in qrcode/2D barcodes
                 #if barcode_type != "qrcode" and content.isnumeric():
@@ -81,12 +357,242 @@ def test_cmd():
                 "--file-type={}".format(file_type),
                 "--label={}".format(content),
                 content,
-                "{}_{}.{}".format(content, "ean", file_type)
+                str(tmp_path / "{}_{}.{}".format(content, "ean", file_type))
             ]
             print(args)
             barcode_main(args)
 
 
+def test_qr_penalty():
+    width = 21
+    light = [0] * width
+    # runs of 21 in 42 lines, 20x20 blocks, no pattern, 0 % dark
+    assert penalty_scores(*pack_both(light, width), width) == \
+        (42 * 19, 3 * 20 * 20, 0, 100)
+    checkerboard = [
+        0x0AAAAA if y & 1 else 0x155555 for y in range(width)
+    ]
+    assert penalty_scores(*pack_both(checkerboard, width), width) == \
+        (0, 0, 0, 0)
+    finder_like = [0b1011101 << 7] + [0] * (width - 1)
+    scores = penalty_scores(*pack_both(finder_like, width), width)
+    # light on both sides in the row, none of the columns are long enough
+    assert scores[2] == 80
+
+
+def test_reed_solomon():
+    random = Random(6)
+    for degree in (7, 10, 18, 30):
+        rse = ReedSolomonEncoder(255 - degree, 255)
+        data = bytes(random.randrange(256) for _ in range(40))
+        assert rse.remainder(data) == \
+            bytes(rse.gf.poly_mod(data, rse.generator))
+    # fields and generators are computed once and shared
+    assert GaloisField.get(285) is GaloisField.get(285)
+    assert ReedSolomonEncoder(245).generator is \
+        ReedSolomonEncoder(245).generator
+    assert rse.cached_generator(30) is rse.cached_generator(30)
+
+
+def test_qr_mask_strategies():
+    data = "HELLO WORLD"
+    best = QRCode(data, "M")
+    assert QRCode(data, "M", mask=3).mask_index == 3
+    assert QRCode(data, "M", mask=timedelta(0)).mask_index == 0
+    assert 0 <= QRCode(data, "M", mask="fast").mask_index < 8
+    cache = {}
+    assert QRCode(data, "M", mask_cache=cache).mask_index == best.mask_index
+    # same version, level, encoding and length reuses the cached mask
+    hinted = QRCode("HELLO THERE", "M", mask=timedelta(0), mask_cache=cache)
+    assert hinted.mask_index == best.mask_index
+
+
+def test_qr_segmentation():
+    segments, bit_length = segment("ORDER-2024-0000012345/abc", 1)
+    assert segments == [
+        ("alphanumeric", "ORDER-2024-"),
+        ("numeric", "0000012345"),
+        ("byte", "/abc")
+    ]
+    assert bit_length == (4 + 9 + 61) + (4 + 10 + 34) + (4 + 8 + 32)
+    # single byte segment would need 4 + 8 + 200 bits, version 3
+    assert version_info("ORDER-2024-0000012345/abc", "Q")[0] == 2
+    assert segment("0123456789", 1)[0] == [("numeric", "0123456789")]
+
+
+def test_qr_encode():
+    # 4 bit mode, 10 bit count, digit triples, terminator, byte padding
+    data_bits = int("".join((
+        "0001", "0000001000", "0000001100", "0101011001", "1000011",
+        "0000", "000"
+    )), 2)
+    assert encode("01234567", "M") == (
+        data_bits.to_bytes(6, "big") + b"\xec\x11" * 5,
+        [("numeric", "01234567")],
+        1
+    )
+    encoded, segments, version = encode("HELLO WORLD", "Q")
+    assert encoded == bytes((
+        32, 91, 11, 120, 209, 114, 220, 77, 67, 64, 236, 17, 236
+    ))
+    encoded, segments, version = encode("ab12345678", "L")
+    assert segments == [("byte", "ab"), ("numeric", "12345678")]
+    # segments are shifted into one stream without byte alignment
+    data_bits = int("".join((
+        "0100", "00000010", "01100001", "01100010",
+        "0001", "0000001000", "0001111011", "0111001000", "1001110",
+        "0000", "0000000"
+    )), 2)
+    assert encoded[:10] == data_bits.to_bytes(10, "big")
+    assert encoded[10:] == b"\xec\x11" * 4 + b"\xec"
+
+
+def test_qr_codewords():
+    # ISO/IEC 18004 annex I, single block of 1-M
+    codewords, version, segments = qr_codewords("01234567", "M")
+    assert version == 1
+    assert codewords == bytes(
+        (16, 32, 12, 86, 97, 128) + (236, 17) * 5 +
+        (165, 36, 212, 193, 237, 54, 199, 135, 44, 85)
+    )
+    # 5-Q has two groups of two blocks, blocks of the second group
+    # are one byte longer
+    data = "There\\'s a frood who really knows where his towel is!"
+    codewords, version, segments = qr_codewords(data, "Q")
+    assert version == 5
+    assert codewords == bytes((
+        67, 246, 182, 70, 85, 246, 230, 247, 70, 66, 247, 118, 134, 7,
+        119, 86, 87, 118, 50, 194, 38, 134, 7, 6, 85, 242, 118, 151,
+        194, 7, 134, 50, 119, 38, 87, 16, 50, 86, 38, 236, 6, 22, 82,
+        17, 18, 198, 6, 236, 6, 199, 134, 17, 103, 146, 151, 236, 38,
+        6, 50, 17, 7, 236, 213, 87, 148, 235, 199, 204, 116, 159, 11,
+        96, 177, 5, 45, 60, 212, 173, 115, 202, 76, 24, 247, 182, 133,
+        147, 241, 124, 75, 59, 223, 157, 242, 33, 229, 200, 238, 106,
+        248, 134, 76, 40, 154, 27, 195, 255, 117, 129, 230, 172, 154,
+        209, 189, 82, 111, 17, 10, 2, 86, 163, 108, 131, 161, 163, 240,
+        32, 111, 120, 192, 178, 39, 133, 141, 236
+    ))
+    # capacity of every symbol equals data codewords of its blocks
+    for version in range(1, 41):
+        for ec_level in "LMQH":
+            layout = CodewordLayout(version, ec_level)
+            capacity = capacities[version - 1][ec_level_index[ec_level]]
+            assert capacity == 8 * layout.data_length
+    assert CodewordLayout(21, "M").data_length == 714
+
+
+def test_qr_matrix():
+    # symbol of ISO/IEC 18004 annex I example with mask 7
+    expected = [
+        "111111100011101111111",
+        "100000100100001000001",
+        "101110100111001011101",
+        "101110100101101011101",
+        "101110100111101011101",
+        "100000101000001000001",
+        "111111101010101111111",
+        "000000000010000000000",
+        "100101101011110100000",
+        "110100001011010100010",
+        "010100101001001111100",
+        "111010011100111111011",
+        "001001110111011100001",
+        "000000001000011010000",
+        "111111100001101011000",
+        "100000101010001001011",
+        "101110100100111001111",
+        "101110101100011100111",
+        "101110100101011100101",
+        "100000100011100101010",
+        "111111101000010101100"
+    ]
+    rows, width = QRCode.image_rows("01234567", "M", mask=7)
+    assert width == 21 + 2 * MARGIN_WIDTH
+    symbol = rows[MARGIN_WIDTH:MARGIN_WIDTH + 21]
+    assert [row >> MARGIN_WIDTH for row in symbol] == \
+        [int(row, 2) for row in expected]
+    # quiet zone is light
+    assert not any(rows[:MARGIN_WIDTH] + rows[MARGIN_WIDTH + 21:])
+    # version information blocks of version 7, least significant bit
+    # first, in columns next to top right and rows above bottom left
+    # finder pattern
+    rows, width = QRCode.image_rows("A" * 155, "M", mask=7)
+    size = width - 2 * MARGIN_WIDTH
+    assert size == 17 + 4 * 7
+    def module(x, y):
+        row = rows[MARGIN_WIDTH + y]
+        return (row >> (width - 1 - MARGIN_WIDTH - x)) & 1
+    for i in range(18):
+        bit = (0x07C94 >> i) & 1
+        assert module(size - 11 + i % 3, i // 3) == bit
+        assert module(i // 3, size - 11 + i % 3) == bit
+
+
+def test_plan():
+    plan = QRCode.plan("HELLO WORLD", "M", scale=2)
+    bits = QRCode.image_bits("HELLO WORLD", "M")
+    assert plan["version"] == 1
+    # modules exclude the quiet zone, width includes it
+    assert plan["modules"] == 21
+    assert plan["width"] == plan["height"] == 2 * len(bits)
+    assert len(bits) == plan["modules"] + 2 * plan["quiet_zone"]
+    for encoding, data in ((Code128, "hello"), (Code93, "hello"),
+                           (Ean, "1234567"), (Ean, "012345678901")):
+        plan = encoding.plan(data, scale=3, barcode_height=20)
+        bar_count = len(list(encoding.bars(data)))
+        assert plan["modules"] + sum(plan["quiet_zone"]) == bar_count
+        assert plan["width"] == 3 * bar_count
+    plan = Code128.plan("0123", encoding="C")
+    assert plan["modules"] + sum(plan["quiet_zone"]) == \
+        len(list(Code128.bars("0123", encoding="C")))
+
+
+def test_code128_auto():
+    # digit run in code set C, switch from B
+    assert list(Code128.encode_auto("SHIP123456789012")) == \
+        [104, 51, 40, 41, 48, 99, 12, 34, 56, 78, 90, 12]
+    assert list(Code128.encode_auto("0123")) == [105, 1, 23]
+    # single lowercase letter is shifted, control characters need A
+    assert list(Code128.encode_auto("\x01\x02a\x03")) == \
+        [103, 65, 66, 98, 65, 67]
+    assert Code128.module_count("SHIP123456789012", encoding="auto") < \
+        Code128.module_count("SHIP123456789012")
+
+
+def test_widths():
+    for encoding, data, extra in (
+            (Code128, "hello World", {}),
+            (Code128, "0123", {"encoding": "C"}),
+            (Code93, "hello world\x00", {}),
+            (Ean, "1234567", {}),
+            (Ean, "012345678901", {})):
+        widths = list(encoding.widths(data, **extra))
+        bits = list(encoding.bars(data, **extra))
+        assert Bitmap.from_widths(widths).row_int(0) == \
+            Bitmap.from_bits(bits).row_int(0)
+        assert sum(widths) == len(bits)
+        row, width = encoding.to_int(data, **extra)
+        assert Bitmap.from_ints([row], width).row_int(0) == \
+            Bitmap.from_widths(widths).row_int(0)
+        assert width == len(bits)
+    img = SvgBarcodeImage(bar_widths=[2, 1, 3, 2, 2], barcode_height=20)
+    assert img.modules.runs(0) == [(2, 1), (6, 2)]
+    assert bars_path_data(img.bar_widths, 10) == "M2 0h1v10h-1zM6 0h2v10h-2z"
+
+
+def test_character_tables():
+    assert bytes(Code93.encode("aB\x00%")) == bytes((46, 10, 11, 44, 30, 42))
+    assert list(Code128.encode_A("A\x01")) == [103, 33, 65]
+    for encode in (Code93.encode, Code128.encode_auto):
+        try:
+            list(encode("x\xe9y\u20ac"))
+        except ValueError as error:
+            # all bad characters reported at once
+            assert "at 1" in str(error) and "at 3" in str(error)
+        else:
+            assert False, "ValueError not raised"
+
+
 if __name__ == "__main__":
     import traceback
 